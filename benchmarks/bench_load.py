@@ -0,0 +1,125 @@
+"""
+Compares loading RawResults through the model (a RawResult per row) with
+the raw-document path (ChicagoLoader(raw_documents=True)), & with the
+model's unordered inserts (ChicagoLoader(ordered=False)), over a synthetic
+election.
+
+Usage:
+    python benchmarks/bench_load.py [--contests N] [--wards N] [--precincts N] [--candidates N]
+                                    [--insert DB_NAME]
+
+Without --insert nothing is written: the paths build their documents as
+they would be handed to the driver. With --insert they're written to the
+given mongo database, read back & deleted again afterwards. Either way the
+documents of each path are compared with the model's field by field.
+"""
+import sys
+import time
+import argparse
+
+from mongoengine import signals
+
+from fixtures import election_pages
+
+from openelex.models import RawResult
+from openelex.us.il.places.chicago.load import ChicagoLoader, LoadResults
+from openelex.us.il.places.chicago.parse import ward_json
+
+SOURCE = 'bench_load.json'
+
+# set to the time of each load, or by the datastore
+UNCOMPARED_FIELDS = ('_id', 'created', 'updated')
+
+
+class DryRunLoader(ChicagoLoader):
+    """
+    Builds what would be inserted without inserting it
+    """
+
+    def __init__(self, **kwargs):
+        ChicagoLoader.__init__(self, **kwargs)
+        self.documents = []
+
+    def insert(self, results):
+        if not self.raw_documents:
+            # as RawResult.objects.insert would
+            signals.pre_bulk_insert.send(RawResult, documents=results)
+            results = [raw_result.to_mongo() for raw_result in results]
+        self.documents.extend(dict(document) for document in results)
+        return len(results)
+
+
+def make_contests(num_contests, num_wards, num_precincts, num_candidates):
+    contests = []
+    for contest_name, wards in election_pages(num_contests, num_wards, num_precincts, num_candidates):
+        results = [ward_json(contest_name, ward, url, page) for ward, url, page in wards]
+        contests.append({'position': contest_name, 'results': [r for r in results if r]})
+    return contests
+
+
+def time_load(loader_class, contests, elec_metadata, **kwargs):
+    loader = loader_class(**kwargs)
+    start = time.time()
+    rows = loader.load(elec_metadata, iter(contests))
+    seconds = time.time() - start
+
+    if loader_class is DryRunLoader:
+        documents = loader.documents
+    else:
+        documents = list(RawResult._get_collection().find({'source': SOURCE}).sort('_id', 1))
+        RawResult.objects(source=SOURCE).delete()
+    return rows, seconds, documents
+
+
+def compare(model_documents, raw_documents):
+    """
+    The first difference between the documents of the two paths, or None
+    """
+    if len(model_documents) != len(raw_documents):
+        return '%s documents vs %s' % (len(model_documents), len(raw_documents))
+
+    for i, (model_document, raw_document) in enumerate(zip(model_documents, raw_documents)):
+        for field in sorted(set(model_document) | set(raw_document)):
+            if field in UNCOMPARED_FIELDS:
+                continue
+            if model_document.get(field) != raw_document.get(field):
+                return 'row %s, %s: %r vs %r' % (i, field, model_document.get(field), raw_document.get(field))
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--contests', type=int, default=5)
+    parser.add_argument('--wards', type=int, default=50)
+    parser.add_argument('--precincts', type=int, default=40)
+    parser.add_argument('--candidates', type=int, default=4)
+    parser.add_argument('--insert', metavar='DB_NAME')
+    args = parser.parse_args()
+
+    contests = make_contests(args.contests, args.wards, args.precincts, args.candidates)
+    elec_metadata = LoadResults().make_elec_metadata('Municipal General - 2/24/15', SOURCE)
+
+    loader_class = DryRunLoader
+    if args.insert:
+        from mongoengine import connect
+        connect(args.insert)
+        loader_class = ChicagoLoader
+
+    timings = []
+    for name, kwargs in [('model', {}), ('raw documents', {'raw_documents': True}), ('unordered', {'ordered': False})]:
+        rows, seconds, documents = time_load(loader_class, contests, elec_metadata, **kwargs)
+        timings.append((name, rows, seconds, documents))
+
+    print '%-16s %-10s %-10s %s' % ('path', 'rows', 'seconds', 'rows/s')
+    for name, rows, seconds, _ in timings:
+        print '%-16s %-10s %-10.2f %.0f' % (name, rows, seconds, rows/seconds)
+
+    for name, _, _, documents in timings[1:]:
+        difference = compare(timings[0][3], documents)
+        if difference:
+            sys.exit('%s loaded different documents from the model: %s' % (name, difference))
+    print '\nraw documents: %.1fx' % (timings[0][2] / timings[1][2])
+
+
+if __name__ == '__main__':
+    main()
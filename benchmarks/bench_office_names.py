@@ -0,0 +1,88 @@
+"""
+Compares transform.clean_office_name, one precompiled regex plus a memo,
+with the search-each-regex-in-turn office name cleaning it replaced, over
+real office strings.
+
+Usage:
+    python benchmarks/bench_office_names.py [JSON_DIR] [--from-db] [--repeat N]
+
+Office strings are the contest positions in JSON_DIR (election_json by
+default), lowercased as the loader stores them, or with --from-db the
+distinct offices of the loaded RawResults.
+"""
+import os
+import re
+import sys
+import time
+import argparse
+
+from openelex.us.il.places.chicago.reader import ElectionReader
+from openelex.us.il.places.chicago import transform
+
+
+def legacy_clean_office_name(office):
+    # what BaseTransform._clean_office_name used to do on every call
+    office_searches = [(srch_regex, clean_office_name) for srch_regex, clean_office_name in transform.OFFICE_SEARCHES]
+    for srch_regex, clean_office_name in office_searches:
+        if re.search(srch_regex, office):
+            return clean_office_name
+    return None
+
+
+def load_offices(json_dir):
+    offices = set()
+    for json_file in sorted(os.listdir(json_dir)):
+        if json_file.endswith('.json'):
+            reader = ElectionReader(os.path.join(json_dir, json_file))
+            offices.update(contest['position'].lower() for contest in reader.contests())
+            reader.close()
+    return sorted(offices)
+
+
+def time_calls(clean, offices, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        for office in offices:
+            clean(office)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('json_dir', nargs='?', default='election_json')
+    parser.add_argument('--from-db', action='store_true')
+    parser.add_argument('--repeat', type=int, default=100)
+    args = parser.parse_args()
+
+    if args.from_db:
+        from openelex.models import RawResult
+        offices = sorted(RawResult.objects.filter(state=transform.STATE, place=transform.PLACE).distinct('office'))
+    else:
+        offices = load_offices(args.json_dir)
+    if not offices:
+        sys.exit('no office strings found')
+
+    different = [(office, legacy_clean_office_name(office), transform.clean_office_name(office))
+                 for office in offices
+                 if legacy_clean_office_name(office) != transform.clean_office_name(office)]
+    for office, old, new in different:
+        print 'DIFFERENT: %r legacy %r, new %r' % (office, old, new)
+    if different:
+        sys.exit('%s of %s office strings clean differently' % (len(different), len(offices)))
+    print '%s distinct office strings, all cleaned identically\n' % len(offices)
+
+    calls = len(offices) * args.repeat
+    legacy_secs = time_calls(legacy_clean_office_name, offices, args.repeat)
+    transform._office_names.clear()
+    cold_secs = time_calls(transform.clean_office_name, offices, 1)
+    new_secs = time_calls(transform.clean_office_name, offices, args.repeat)
+
+    print '%-24s %-12s %s' % ('', 'calls', 'us/call')
+    print '%-24s %-12s %.2f' % ('legacy', calls, legacy_secs / calls * 1e6)
+    print '%-24s %-12s %.2f' % ('precompiled, first call', len(offices), cold_secs / len(offices) * 1e6)
+    print '%-24s %-12s %.2f' % ('precompiled, memoized', calls, new_secs / calls * 1e6)
+    print '\n%.1fx' % (legacy_secs / new_secs)
+
+
+if __name__ == '__main__':
+    main()
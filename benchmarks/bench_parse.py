@@ -0,0 +1,127 @@
+"""
+Compares the single-pass ward table parser with the xpath-per-cell parsing
+it replaced, over saved ward results pages.
+
+Usage:
+    python benchmarks/bench_parse.py [PAGE_DIR] [--repeat N]
+
+PAGE_DIR holds saved ward results pages (*.html) or is a scraper cache
+directory (*.gz entries); it defaults to .cache, & where that has no ward
+pages the synthetic pages from fixtures.py are used instead.
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+
+import lxml.html
+
+from fixtures import election_pages
+
+from openelex.us.il.places.chicago.cache import HTTPCache
+from openelex.us.il.places.chicago.parse import parse_ward_table
+
+
+def legacy_parse_ward_table(page):
+    # the parsing that used to live in Scraper.make_contest_json
+    tree = lxml.html.fromstring(page)
+
+    header_td_list = tree.xpath("//table[1]//tr[2]//td")
+    tbl_header = [td.xpath("string(.)") for td in header_td_list]
+    num_cols = len(tbl_header)
+
+    rows = tree.xpath("//table[1]//tr")
+    first_col_str = [tr.xpath("td")[0].xpath("string(.)") if tr.xpath("td") else None for tr in rows]
+    if 'Total' in first_col_str:
+        idx_total_row = list(reversed(first_col_str)).index('Total')
+        precinct_td_list = tree.xpath("//table[1]//tr[position() > 2 and not(position() > last()-%s)]//td" % (idx_total_row+1))
+    else:
+        precinct_td_list = tree.xpath("//table[1]//tr[position() > 2]//td")
+    precinct_data = [precinct_td_list[i:i+num_cols] for i in range(0, len(precinct_td_list), num_cols)]
+
+    totals = []
+    if precinct_data:
+        for i in range(0, len(precinct_data[0])):
+            col_total = 0
+            for row in precinct_data:
+                try:
+                    col_total += int(row[i].xpath("string(.)"))
+                except:
+                    col_total = None
+            totals.append(col_total)
+
+    rows = [[td.xpath("string(.)") for td in row] for row in precinct_data]
+    return tbl_header, rows, totals
+
+
+def load_pages(page_dir):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(page_dir, '*.html'))):
+        with open(path) as f:
+            pages.append((os.path.basename(path), f.read()))
+
+    # HTTPCache would create the directory
+    if os.path.isdir(page_dir):
+        for entry in HTTPCache(page_dir).entries():
+            if 'election3.asp' not in entry.meta['url']:
+                pages.append((entry.meta['url'], entry.content))
+
+    return [(name, page) for name, page in pages
+            if 'ward, election selected or contest was bad' not in page.lower()]
+
+
+def fixture_pages():
+    # wards of a few sizes, as there'd be in a real cache
+    pages = []
+    for num_precincts in (10, 40, 80):
+        for _, wards in election_pages(2, 10, num_precincts, 5, seed=num_precincts):
+            pages.extend((url, page) for _, url, page in wards)
+    return pages
+
+
+def time_parser(parser, page, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        parser(page)
+    return (time.time() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('page_dir', nargs='?')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    pages = load_pages(args.page_dir or '.cache')
+    if not pages and not args.page_dir:
+        print 'no ward pages in .cache, using the fixture pages\n'
+        pages = fixture_pages()
+
+    timings = []
+    for name, page in pages:
+        new = parse_ward_table(page)
+        if not new[1]:
+            continue
+        old = legacy_parse_ward_table(page)
+        if new != old:
+            sys.exit('parsers disagree on %s' % name)
+        timings.append((len(new[1]), name,
+                        time_parser(legacy_parse_ward_table, page, args.repeat),
+                        time_parser(parse_ward_table, page, args.repeat)))
+
+    if not timings:
+        sys.exit('no ward pages found in %s' % (args.page_dir or '.cache'))
+
+    timings.sort(reverse=True)
+    print '%-8s %-12s %-12s %s' % ('rows', 'legacy (ms)', 'new (ms)', 'speedup')
+    for num_rows, name, old_secs, new_secs in timings[:10]:
+        print '%-8s %-12.2f %-12.2f %.1fx' % (num_rows, old_secs*1000, new_secs*1000, old_secs/new_secs)
+
+    old_total = sum(t[2] for t in timings)
+    new_total = sum(t[3] for t in timings)
+    print '\n%s pages: legacy %.2fs, new %.2fs, %.1fx' % (len(timings), old_total, new_total, old_total/new_total)
+
+
+if __name__ == '__main__':
+    main()
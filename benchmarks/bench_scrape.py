@@ -0,0 +1,191 @@
+"""
+Times the scrape-to-json path (Scraper.make_contest_json &
+make_elections_json) over synthetic ward pages of different sizes, with
+no network.
+
+Usage:
+    python benchmarks/bench_scrape.py [--scenario NAME ...] [--threshold PCT]
+
+Each scenario runs in its own process so its peak memory can be measured.
+The parse cache is off except in the warm_parse_cache scenario, where it's
+filled before anything is timed.
+Results are saved under benchmarks/results/ & compared with the previous
+run; anything slower or bigger by more than --threshold percent is flagged.
+"""
+import os
+import sys
+import json
+import glob
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+
+from fixtures import election_pages
+
+from openelex.us.il.places.chicago.scraper import Scraper
+from openelex.us.il.places.chicago.writer import ElectionWriter
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+BASE = {'contests': 5, 'wards': 50, 'precincts': 40, 'candidates': 4, 'broken_every': 25, 'parse_cache': False}
+
+SCENARIOS = [
+    ('base', {}),
+    ('wards_10', {'wards': 10}),
+    ('precincts_10', {'precincts': 10}),
+    ('precincts_80', {'precincts': 80}),
+    ('candidates_1', {'candidates': 1}),
+    ('candidates_12', {'candidates': 12}),
+    ('contests_20', {'contests': 20}),
+    ('no_broken_pages', {'broken_every': 0}),
+    ('warm_parse_cache', {'parse_cache': True}),
+]
+
+MEASURES = ['parse_seconds', 'write_seconds', 'elections_json_seconds', 'peak_rss_kb']
+
+
+class FixtureScraper(Scraper):
+    """
+    Serves ward pages from memory instead of the site
+    """
+
+    def __init__(self, pages, parse_cache_dir=None, **kwargs):
+        super(FixtureScraper, self).__init__(metrics_file=None, parse_cache_dir=parse_cache_dir, **kwargs)
+        self.pages = pages
+
+    def fetch_ward_page(self, contest_name, ward, url):
+        return self.pages[url]
+
+
+def run_scenario(sizes):
+    contests = election_pages(sizes['contests'], sizes['wards'], sizes['precincts'],
+                              sizes['candidates'], sizes['broken_every'])
+    pages = dict((url, page) for _, wards in contests for _, url, page in wards)
+    contest_urls = [(contest_name, [(ward, url) for ward, url, _ in wards]) for contest_name, wards in contests]
+
+    work_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    stdout = sys.stdout
+    try:
+        os.chdir(work_dir)
+        os.makedirs('election_json')
+        # the scraper's progress & broken page messages
+        sys.stdout = open(os.devnull, 'w')
+        if sizes['parse_cache']:
+            scraper = FixtureScraper(pages, parse_cache_dir='parse_cache')
+            for contest_name, urls in contest_urls:
+                scraper.make_contest_json(contest_name, urls)
+        else:
+            scraper = FixtureScraper(pages)
+
+        start = time.time()
+        contest_jsons = [scraper.make_contest_json(contest_name, urls) for contest_name, urls in contest_urls]
+        parse_seconds = time.time() - start
+
+        start = time.time()
+        writer = ElectionWriter(os.path.join(work_dir, 'written.json'), 'Benchmark Election')
+        for contest_json in contest_jsons:
+            writer.write_contest(contest_json)
+        writer.close()
+        write_seconds = time.time() - start
+        json_bytes = os.path.getsize(writer.filename)
+
+        # the whole thing, with checkpoints
+        start = time.time()
+        scraper.make_elections_json('xxxx Benchmark Election - 2/24/15', contest_urls, None, None)
+        elections_json_seconds = time.time() - start
+    finally:
+        sys.stdout = stdout
+        os.chdir(cwd)
+        shutil.rmtree(work_dir)
+
+    return {
+        'pages': len(pages),
+        'json_bytes': json_bytes,
+        'parse_seconds': parse_seconds,
+        'write_seconds': write_seconds,
+        'elections_json_seconds': elections_json_seconds,
+        # kilobytes on linux
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def run_in_subprocess(sizes):
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--run-one', json.dumps(sizes)])
+    return json.loads(output)
+
+
+def previous_results():
+    paths = sorted(glob.glob(os.path.join(RESULTS_DIR, 'bench_scrape-*.json')))
+    if paths:
+        with open(paths[-1]) as f:
+            return os.path.basename(paths[-1]), json.load(f)
+    return None, {}
+
+
+def save_results(results):
+    if not os.path.exists(RESULTS_DIR):
+        os.makedirs(RESULTS_DIR)
+    path = os.path.join(RESULTS_DIR, 'bench_scrape-%s.json' % time.strftime('%Y%m%d-%H%M%S'))
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=4, sort_keys=True)
+    return path
+
+
+def change(new, old):
+    if not old:
+        return ''
+    pct = 100.0 * (new - old) / old
+    return '%+.0f%%' % pct
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenario', action='append', choices=[name for name, _ in SCENARIOS])
+    parser.add_argument('--threshold', type=float, default=10)
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        print json.dumps(run_scenario(json.loads(args.run_one)))
+        return
+
+    previous_name, previous = previous_results()
+    if previous_name:
+        print 'comparing with %s\n' % previous_name
+
+    results = {}
+    regressions = []
+    print '%-16s %-7s %-14s %-14s %-14s %s' % ('scenario', 'pages', 'parse (s)', 'write (s)', 'total (s)', 'peak rss (MB)')
+    for name, overrides in SCENARIOS:
+        if args.scenario and name not in args.scenario:
+            continue
+        sizes = dict(BASE, **overrides)
+        result = run_in_subprocess(sizes)
+        result['sizes'] = sizes
+        results[name] = result
+
+        old = previous.get(name, {}) if previous.get(name, {}).get('sizes') == sizes else {}
+        print '%-16s %-7s %-14s %-14s %-14s %s' % (
+            name, result['pages'],
+            '%.3f %s' % (result['parse_seconds'], change(result['parse_seconds'], old.get('parse_seconds'))),
+            '%.3f %s' % (result['write_seconds'], change(result['write_seconds'], old.get('write_seconds'))),
+            '%.3f %s' % (result['elections_json_seconds'], change(result['elections_json_seconds'], old.get('elections_json_seconds'))),
+            '%.1f %s' % (result['peak_rss_kb']/1024.0, change(result['peak_rss_kb'], old.get('peak_rss_kb'))))
+
+        for measure in MEASURES:
+            if old.get(measure) and result[measure] > old[measure] * (1 + args.threshold/100.0):
+                regressions.append('%s %s: %g -> %g' % (name, measure, old[measure], result[measure]))
+
+    print '\nsaved %s' % save_results(results)
+    if regressions:
+        print '\nregressions over %s%%:' % args.threshold
+        for regression in regressions:
+            print '  ' + regression
+
+
+if __name__ == '__main__':
+    main()
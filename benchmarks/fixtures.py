@@ -0,0 +1,83 @@
+"""
+Synthetic chicagoelections.com ward results pages, for benchmarks.
+
+Pages are laid out like the real site's: a title row, a header row of
+Precinct, Votes & then a name & percentage column per candidate, one row
+per precinct, a Total row, and sometimes a note row after the Total.
+Single-candidate contests have just Precinct & the candidate's column.
+"""
+import random
+
+CANDIDATE_NAMES = ['RAHM EMANUEL', 'JESUS "CHUY" GARCIA', 'WILLIE L. WILSON', 'ROBERT W. FIORETTI',
+                   'WILLIAM WALLS III', 'TONI PRECKWINKLE', 'BOB FIORETTI', 'AMARA ENYIA',
+                   'GARRY MCCARTHY', 'LORI LIGHTFOOT', 'BILL DALEY', 'SUSANA MENDOZA']
+
+BROKEN_PAGE = '<html><body>Ward, election selected or contest was bad</body></html>'
+
+
+def candidates(num_candidates):
+    names = CANDIDATE_NAMES * (num_candidates // len(CANDIDATE_NAMES) + 1)
+    return ['%s %s' % (name, i) if i >= len(CANDIDATE_NAMES) else name
+            for i, name in enumerate(names[:num_candidates])]
+
+
+def ward_page(contest_name, ward, num_precincts, candidate_names, seed=0, note=False):
+    rnd = random.Random('%s-%s-%s' % (seed, contest_name, ward))
+
+    rows = ['<tr><td colspan="%s">%s - Ward %s</td></tr>' % (2*len(candidate_names)+2, contest_name, ward)]
+    if len(candidate_names) > 1:
+        rows.append('<tr><td>Precinct</td><td>Votes</td>%s</tr>' %
+                    ''.join('<td>%s</td><td>%%</td>' % name for name in candidate_names))
+    else:
+        rows.append('<tr><td>Precinct</td><td>%s</td></tr>' % candidate_names[0])
+
+    totals = [0] * len(candidate_names)
+    for precinct in range(1, num_precincts+1):
+        votes = [rnd.randint(0, 400) for _ in candidate_names]
+        totals = [t + v for t, v in zip(totals, votes)]
+        rows.append(_result_row(str(precinct), votes))
+    rows.append(_result_row('Total', totals))
+    if note:
+        rows.append('<tr><td>Provisional ballots are not included in these totals</td></tr>')
+
+    return '<html><body><table>%s</table></body></html>' % ''.join(rows)
+
+
+def _result_row(label, votes):
+    if len(votes) == 1:
+        return '<tr><td>%s</td><td>%s</td></tr>' % (label, votes[0])
+
+    cast = sum(votes)
+    cells = ''.join('<td>%s</td><td>%.2f%%</td>' % (v, 100.0*v/cast if cast else 0) for v in votes)
+    return '<tr><td>%s</td><td>%s</td>%s</tr>' % (label, cast, cells)
+
+
+def contest_pages(contest_name, num_wards, num_precincts, num_candidates, broken_every=0, seed=0):
+    """
+    Returns (ward, url, page) for each ward of a contest. Every
+    broken_every'th ward gets the site's broken results page instead.
+    """
+    candidate_names = candidates(num_candidates)
+    pages = []
+    for ward in range(1, num_wards+1):
+        url = 'http://www.chicagoelections.com/en/pctlevel3.asp?Ward=%s&elec_code=10&race_number=%s' % (ward, abs(hash(contest_name)) % 1000)
+        if broken_every and ward % broken_every == 0:
+            page = BROKEN_PAGE
+        else:
+            page = ward_page(contest_name, ward, num_precincts, candidate_names, seed, note=ward % 3 == 0)
+        pages.append((str(ward), url, page))
+    return pages
+
+
+def election_pages(num_contests, num_wards, num_precincts, num_candidates, broken_every=0, seed=0):
+    """
+    Returns (contest_name, [(ward, url, page), ...]) for each contest of an
+    election. Every fourth contest is a single-candidate one.
+    """
+    contests = []
+    for i in range(num_contests):
+        contest_name = 'Alderman %sth Ward' % (i+1)
+        contest_candidates = 1 if i % 4 == 3 else num_candidates
+        contests.append((contest_name, contest_pages(contest_name, num_wards, num_precincts,
+                                                     contest_candidates, broken_every, seed)))
+    return contests
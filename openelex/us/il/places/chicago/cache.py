@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import time
+import zlib
+import hashlib
+import urllib
+import threading
+
+import requests
+
+# (url regex, seconds an entry is served without revalidating), first match wins
+DEFAULT_TTL_POLICY = [
+    # the election & contest menus pick up new elections & contests
+    (r'election3\.asp', 24*60*60),
+    # ward result pages only change while an election is being counted
+    (r'', 7*24*60*60),
+]
+
+class CacheEntry(object):
+
+    def __init__(self, meta, content):
+        self.meta = meta
+        self.content = content
+
+    def is_fresh(self, ttl):
+        # the ttl comes from the policy of whoever is reading the entry, not
+        # whoever wrote it, so e.g. election night polling revalidates pages
+        # cached under the default policy
+        return time.time() - self.meta['fetched'] < ttl
+
+    def validators(self):
+        """
+        Conditional request headers for revalidating this entry
+        """
+        headers = {}
+        if self.meta['headers'].get('etag'):
+            headers['If-None-Match'] = self.meta['headers']['etag']
+        if self.meta['headers'].get('last-modified'):
+            headers['If-Modified-Since'] = self.meta['headers']['last-modified']
+        return headers
+
+    def response(self):
+        resp = requests.Response()
+        resp.status_code = self.meta['status']
+        resp.url = self.meta['url']
+        resp.headers = requests.structures.CaseInsensitiveDict(self.meta['headers'])
+        resp.encoding = self.meta['encoding']
+        resp._content = self.content
+        resp.fromcache = True
+        return resp
+
+
+class HTTPCache(object):
+    """
+    Compressed, size-capped on-disk cache of http responses.
+
+    Entries are served as-is until the ttl for their url runs out. After
+    that they're revalidated with the server (ETag/Last-Modified, or by
+    comparing a hash of the content when the server sends neither) rather
+    than refetched blindly. Once the cache grows past max_bytes the least
+    recently used entries are evicted.
+    """
+
+    def __init__(self, cache_dir='.cache', ttl_policy=DEFAULT_TTL_POLICY, max_bytes=2*1024**3):
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.cache_dir = cache_dir
+        self.ttl_policy = [(re.compile(pattern), ttl) for pattern, ttl in ttl_policy]
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._sizes = {}
+        self._last_used = {}
+        for filename in os.listdir(cache_dir):
+            if filename.endswith('.gz'):
+                path = os.path.join(cache_dir, filename)
+                self._sizes[path] = os.path.getsize(path)
+                self._last_used[path] = os.path.getmtime(path)
+        self._total_bytes = sum(self._sizes.itervalues())
+
+    def key_for_request(self, method, url, params=None, data=None, context=None):
+        """
+        GETs are keyed on the url. The election & contest menus are POSTs
+        back to the same url, so their form data is part of the key. What a
+        contest menu POST returns also depends on the election selected
+        before it, which is passed in as context.
+        """
+        url = requests.Request(url=url, params=params or {}).prepare().url
+        key = '%s %s' % (method.upper(), url)
+        if data:
+            form = sorted((k, unicode(v).encode('utf-8')) for k, v in data.items())
+            key += ' ' + urllib.urlencode(form)
+        if context:
+            key += ' ' + unicode(context).encode('utf-8')
+        return key
+
+    def ttl(self, url):
+        for pattern, ttl in self.ttl_policy:
+            if pattern.search(url):
+                return ttl
+        return 0
+
+    def get(self, key):
+        path = self._path(key)
+        entry = self._read(path)
+        if entry:
+            self._touch(path)
+        return entry
+
+    def entries(self):
+        for path in sorted(self._sizes):
+            entry = self._read(path)
+            if entry:
+                yield entry
+
+    def set(self, key, response, fetched=None):
+        meta = {
+            'url': response.url,
+            'status': response.status_code,
+            'headers': dict((k.lower(), v) for k, v in response.headers.items()),
+            'encoding': response.encoding,
+            'fetched': fetched or time.time(),
+            'sha1': content_hash(response.content),
+        }
+        data = zlib.compress(json.dumps(meta)+'\n'+response.content)
+
+        path = self._path(key)
+        tmp_path = '%s.%s.tmp' % (path, threading.current_thread().ident)
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+
+        with self._lock:
+            self._total_bytes += len(data) - self._sizes.get(path, 0)
+            self._sizes[path] = len(data)
+            self._last_used[path] = time.time()
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def revalidated(self, key, entry, response):
+        """
+        Restarts the ttl of an entry the server says is unchanged,
+        keeping any new validators it sent along
+        """
+        for header in ('etag', 'last-modified'):
+            if response.headers.get(header):
+                entry.meta['headers'][header] = response.headers[header]
+        self.set(key, entry.response())
+
+    def _evict(self):
+        # drop down to 90% of the cap so we don't evict on every write
+        target = self.max_bytes * 0.9
+        for path in sorted(self._last_used, key=self._last_used.get):
+            if self._total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self._total_bytes -= self._sizes.pop(path)
+            del self._last_used[path]
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                raw = zlib.decompress(f.read())
+        except (IOError, OSError, zlib.error):
+            return None
+
+        meta, content = raw.split('\n', 1)
+        return CacheEntry(json.loads(meta), content)
+
+    def _touch(self, path):
+        with self._lock:
+            self._last_used[path] = time.time()
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key).hexdigest()+'.gz')
+
+
+def content_hash(content):
+    return hashlib.sha1(content).hexdigest()
@@ -0,0 +1,80 @@
+import os
+import json
+
+class Checkpoint(object):
+    """
+    Manifest of the contests already scraped for one election.
+
+    Each completed contest is appended to the manifest as one line of json
+    holding the contest name & its parsed results, so that a restarted
+    scrape can continue from the first unfinished contest.
+    """
+
+    def __init__(self, slug, checkpoint_dir='.checkpoints'):
+        if not os.path.exists(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+
+        self.path = os.path.join(checkpoint_dir, slug+'.jsonl')
+
+    def resume(self, contest_names):
+        """
+        Yields the recorded results for the contests at the start of
+        contest_names, one at a time. Once exhausted, anything recorded
+        past the first contest that doesn't line up (or past a line cut
+        short by a crash) is dropped from the manifest.
+        """
+        num_contests = 0
+        for _, entry in self._entries():
+            if num_contests == len(contest_names) or entry['contest_name'] != contest_names[num_contests]:
+                break
+            yield entry['contest']
+            num_contests += 1
+
+        self.truncate(num_contests)
+
+    def contest_names(self):
+        return [entry['contest_name'] for _, entry in self._entries()]
+
+    def truncate(self, num_contests):
+        """
+        Drops everything recorded after the first num_contests contests
+        """
+        if not os.path.exists(self.path):
+            return
+
+        valid_bytes = 0
+        for i, (line_length, _) in enumerate(self._entries()):
+            if i == num_contests:
+                break
+            valid_bytes += line_length
+
+        with open(self.path, 'r+') as f:
+            f.truncate(valid_bytes)
+
+    def record(self, contest_name, contest_json):
+        entry = {
+            'contest_name': contest_name,
+            'contest': contest_json
+        }
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry)+'\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _entries(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path) as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                yield len(line), entry
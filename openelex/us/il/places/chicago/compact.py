@@ -0,0 +1,198 @@
+"""
+Compact, indexed alternative to the pretty-printed election json.
+
+File layout (little-endian):
+
+    'OECF' + uint32 version
+    one block per contest:
+        uint32 length of the block's json metadata
+        json metadata: position, candidate names (stored once per contest),
+                       ward names & precinct names
+        int32 votes: for each ward, the ward totals followed by each
+                     precinct's votes, one column per candidate, with -1
+                     where a candidate has no count
+    json index: election name & the (position, offset, length) of each block
+    uint64 offset of the index + uint32 length of the index + 'OECF'
+
+The index at the end lets a reader memory-map the file & seek straight to
+one contest without parsing the others.
+
+To convert existing json files:
+    python -m openelex.us.il.places.chicago.compact election_json election_compact
+"""
+import os
+import sys
+import json
+import mmap
+import struct
+
+MAGIC = 'OECF'
+VERSION = 1
+NO_VOTES = -1
+
+HEADER = struct.Struct('<4sI')
+FOOTER = struct.Struct('<QI4s')
+BLOCK_HEADER = struct.Struct('<I')
+
+class CompactWriter(object):
+    """
+    Writes an election in the compact format one contest at a time, with
+    the same interface as ElectionWriter
+    """
+
+    def __init__(self, filename, election_name):
+        self.filename = filename
+        self.part_filename = filename+'.part'
+        self.election_name = election_name
+        self.num_contests = 0
+
+        self._index = []
+        self._file = open(self.part_filename, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION))
+
+    def write_contest(self, contest_json):
+        candidates = []
+        seen = set()
+        for ward_result in contest_json['results']:
+            for candidate_totals in [ward_result['candidate_totals']] + [p['candidate_totals'] for p in ward_result['results_by_precinct']]:
+                for candidate in candidate_totals:
+                    if candidate not in seen:
+                        seen.add(candidate)
+                        candidates.append(candidate)
+
+        wards = []
+        votes = []
+        for ward_result in contest_json['results']:
+            precincts = [p['precinct'] for p in ward_result['results_by_precinct']]
+            wards.append([ward_result['ward'], precincts])
+            for candidate_totals in [ward_result['candidate_totals']] + [p['candidate_totals'] for p in ward_result['results_by_precinct']]:
+                votes.extend(candidate_totals.get(candidate, NO_VOTES) for candidate in candidates)
+
+        meta = json.dumps({
+            'position': contest_json['position'],
+            'candidates': candidates,
+            'wards': wards,
+        })
+
+        offset = self._file.tell()
+        self._file.write(BLOCK_HEADER.pack(len(meta)))
+        self._file.write(meta)
+        self._file.write(struct.pack('<%di' % len(votes), *votes))
+
+        self._index.append((contest_json['position'], offset, self._file.tell() - offset))
+        self.num_contests += 1
+
+    def close(self):
+        index = json.dumps({
+            'election_name': self.election_name,
+            'contests': self._index,
+        })
+        index_offset = self._file.tell()
+        self._file.write(index)
+        self._file.write(FOOTER.pack(index_offset, len(index), MAGIC))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+        os.rename(self.part_filename, self.filename)
+
+
+class CompactElection(object):
+    """
+    Read access to a compact election file. The file is memory-mapped, and
+    contests are only decoded when asked for.
+    """
+
+    def __init__(self, filename):
+        self._file = open(filename, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version = HEADER.unpack_from(self._mmap, 0)
+        index_offset, index_length, end_magic = FOOTER.unpack_from(self._mmap, len(self._mmap) - FOOTER.size)
+        if magic != MAGIC or end_magic != MAGIC:
+            raise ValueError('%s is not a compact election file' % filename)
+        if version != VERSION:
+            raise ValueError('%s is version %s, expected %s' % (filename, version, VERSION))
+
+        index = json.loads(self._mmap[index_offset:index_offset+index_length])
+        self.election_name = index['election_name']
+        self._index = index['contests']
+        self._positions = dict((position, i) for i, (position, _, _) in reversed(list(enumerate(self._index))))
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        for i in range(len(self._index)):
+            yield self.contest(i)
+
+    def contest_names(self):
+        return [position for position, _, _ in self._index]
+
+    def contest(self, key):
+        """
+        Returns a contest, by position in the file or by name, in the same
+        shape as the contests in the election json
+        """
+        if not isinstance(key, int):
+            key = self._positions[key]
+        _, offset, length = self._index[key]
+
+        meta_length, = BLOCK_HEADER.unpack_from(self._mmap, offset)
+        meta_offset = offset + BLOCK_HEADER.size
+        meta = json.loads(self._mmap[meta_offset:meta_offset+meta_length])
+
+        votes_offset = meta_offset + meta_length
+        num_votes = (offset + length - votes_offset) // 4
+        votes = struct.unpack_from('<%di' % num_votes, self._mmap, votes_offset)
+
+        candidates = meta['candidates']
+        rows = (votes[i:i+len(candidates)] for i in range(0, num_votes, len(candidates) or 1))
+
+        def candidate_totals(row):
+            return dict((c, v) for c, v in zip(candidates, row) if v != NO_VOTES)
+
+        results = []
+        for ward, precincts in meta['wards']:
+            ward_result = {
+                'ward': ward,
+                'candidate_totals': candidate_totals(next(rows)) if candidates else {},
+                'results_by_precinct': [],
+            }
+            for precinct in precincts:
+                ward_result['results_by_precinct'].append({
+                    'precinct': precinct,
+                    'candidate_totals': candidate_totals(next(rows)) if candidates else {},
+                })
+            results.append(ward_result)
+
+        return {
+            'position': meta['position'],
+            'results': results,
+        }
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+
+def convert(json_filename, compact_filename):
+    with open(json_filename) as f:
+        election_json = json.load(f)
+
+    writer = CompactWriter(compact_filename, election_json['election_name'])
+    for contest_json in election_json['contests']:
+        writer.write_contest(contest_json)
+    writer.close()
+
+
+if __name__ == '__main__':
+    json_dir, compact_dir = sys.argv[1:3]
+    if not os.path.exists(compact_dir):
+        os.makedirs(compact_dir)
+
+    for json_file in sorted(os.listdir(json_dir)):
+        if json_file.endswith('.json'):
+            print 'converting', json_file
+            convert(os.path.join(json_dir, json_file),
+                    os.path.join(compact_dir, json_file[:-len('.json')]+'.oec'))
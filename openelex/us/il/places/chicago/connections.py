@@ -0,0 +1,54 @@
+import threading
+
+import requests
+
+class PooledAdapter(requests.adapters.HTTPAdapter):
+    """
+    HTTPAdapter that keeps count of the connections its pools have opened,
+    so connection reuse can be reported
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._lock = threading.Lock()
+        self._closed_pool_stats = {'requests': 0, 'connections': 0}
+        self._sends = threading.local()
+        super(PooledAdapter, self).__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        self._sends.count = self.sends() + 1
+        return super(PooledAdapter, self).send(request, **kwargs)
+
+    def sends(self):
+        """
+        Number of requests sent by the current thread since reset_sends;
+        more than one for a single scraper request means it was retried
+        """
+        return getattr(self._sends, 'count', 0)
+
+    def reset_sends(self):
+        self._sends.count = 0
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(PooledAdapter, self).init_poolmanager(*args, **kwargs)
+        # pools dropped from the pool manager take their counts with them
+        dispose = self.poolmanager.pools.dispose_func
+        def dispose_func(pool):
+            self._add_pool_stats(self._closed_pool_stats, pool)
+            if dispose:
+                dispose(pool)
+        self.poolmanager.pools.dispose_func = dispose_func
+
+    def connection_stats(self):
+        with self._lock:
+            stats = dict(self._closed_pool_stats)
+        for key in self.poolmanager.pools.keys():
+            pool = self.poolmanager.pools.get(key)
+            if pool:
+                self._add_pool_stats(stats, pool)
+        stats['reused'] = stats['requests'] - stats['connections']
+        return stats
+
+    def _add_pool_stats(self, stats, pool):
+        with self._lock:
+            stats['requests'] += pool.num_requests
+            stats['connections'] += pool.num_connections
@@ -0,0 +1,132 @@
+"""
+Election-night polling of one election's results.
+
+Rather than rescraping the whole election, each poll revalidates the ward
+pages of every contest (conditional requests, so unchanged pages cost a
+304), reparses only the pages whose content changed, and appends a line to
+an NDJSON delta file for every precinct whose counts changed. The first
+poll writes every precinct.
+
+Usage:
+    python -m openelex.us.il.places.chicago.live [--election NAME] [--interval SECONDS]
+                                                 [--output FILE] [--polls N] [--workers N]
+
+--election matches part of an election's name on the site, & defaults to
+the first (most recent) election listed.
+"""
+import sys
+import json
+import time
+import argparse
+import datetime
+
+from openelex.us.il.places.chicago.cache import content_hash
+from openelex.us.il.places.chicago.parse import ward_json
+from openelex.us.il.places.chicago.pipeline import SUMMARY_CONTESTS
+from openelex.us.il.places.chicago.scraper import Scraper
+
+LIVE_TTL_POLICY = [
+    # new contests don't show up during the count
+    (r'election3\.asp', 60*60),
+    # ward pages are always revalidated
+    (r'', 0),
+]
+
+class LivePoller(object):
+
+    def __init__(self, scraper, elec_name, output, interval=60):
+        self.scraper = scraper
+        self.elec_name = elec_name
+        self.output = output
+        self.interval = interval
+
+        self.contests = None
+        # last seen content hash & parsed precincts of each ward page
+        self._hashes = {}
+        self._precincts = {}
+
+    def run(self, polls=None):
+        num_polls = 0
+        while polls is None or num_polls < polls:
+            start = time.time()
+            changed = self.poll()
+            num_polls += 1
+            print 'POLL %s: %s precincts changed in %.1fs' % (num_polls, changed, time.time() - start)
+
+            if polls is None or num_polls < polls:
+                time.sleep(max(0, self.interval - (time.time() - start)))
+
+    def poll(self):
+        """
+        Fetches every ward page once & writes out the precincts that
+        changed. Returns the number of changed precincts.
+        """
+        if self.contests is None:
+            self.contests = [(contest_name, contest_urls)
+                             for contest_name, contest_urls in self.scraper.contest_urls(self.elec_name)
+                             if not any(summary in contest_name for summary in SUMMARY_CONTESTS)]
+
+        polled_at = datetime.datetime.utcnow().isoformat()
+        changed = 0
+        for contest_name, contest_urls in self.contests:
+            fetch = lambda ward_url: self.scraper.fetch_ward_page(contest_name, *ward_url)
+            if self.scraper.workers > 1:
+                pages = self.scraper.ward_pool().map(fetch, contest_urls)
+            else:
+                pages = map(fetch, contest_urls)
+
+            for (ward, url), page in zip(contest_urls, pages):
+                page_hash = content_hash(page.encode('utf-8'))
+                if self._hashes.get(url) == page_hash:
+                    continue
+                self._hashes[url] = page_hash
+
+                # not through the parse cache: a changed page is parsed once
+                # here anyway, & caching every version of it would only fill it
+                ward_result = ward_json(contest_name, ward, url, page)
+                if ward_result:
+                    changed += self.write_deltas(polled_at, contest_name, ward_result)
+
+        self.output.flush()
+        self.scraper.write_metrics()
+        return changed
+
+    def write_deltas(self, polled_at, contest_name, ward_result):
+        changed = 0
+        for precinct_result in ward_result['results_by_precinct']:
+            key = (contest_name, ward_result['ward'], precinct_result['precinct'])
+            if self._precincts.get(key) == precinct_result['candidate_totals']:
+                continue
+            self._precincts[key] = precinct_result['candidate_totals']
+
+            self.output.write(json.dumps({
+                'polled_at': polled_at,
+                'election': self.elec_name[5:],
+                'contest': contest_name,
+                'ward': ward_result['ward'],
+                'precinct': precinct_result['precinct'],
+                'candidate_totals': precinct_result['candidate_totals'],
+            }, sort_keys=True) + '\n')
+            changed += 1
+        return changed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--election')
+    parser.add_argument('--interval', type=int, default=60)
+    parser.add_argument('--output', default='live_results.ndjson')
+    parser.add_argument('--polls', type=int)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    scraper = Scraper(workers=args.workers, cache_ttl_policy=LIVE_TTL_POLICY)
+    elec_names = scraper.election_names()
+    if args.election:
+        elec_names = [elec_name for elec_name in elec_names if args.election.lower() in elec_name.lower()]
+    if not elec_names:
+        sys.exit('no election matching %s' % args.election)
+
+    print 'POLLING', elec_names[0]
+    with open(args.output, 'a') as output:
+        LivePoller(scraper, elec_names[0], output, args.interval).run(args.polls)
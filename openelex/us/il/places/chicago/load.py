@@ -1,13 +1,179 @@
 import os
+import re
 import json
+import time
+import hashlib
 import datetime
-import probablepeople as pp
+import traceback
+import multiprocessing
+from mongoengine import signals
+from mongoengine.connection import get_db
 
 from openelex.models import RawResult
+from openelex.us.il.places.chicago.namecache import NAME_CACHE
+from openelex.us.il.places.chicago.profiling import StageProfiler, NullProfiler
+from openelex.us.il.places.chicago.reader import ElectionReader
 
 STATE = 'IL'
 PLACE = 'Chicago'
 
+KNOWN_OFFICES = [
+	# national
+	'president of the united states',
+	'president and vice president of the united states',
+	'pres and vice pres',
+	'president, u.s.',
+	'senator, u.s.',
+	'united states senator',
+	'u.s. senator',
+	'u.s. representative',
+	'representative in congress',
+	'rep. in congress',
+
+	# state
+	'governor',
+	'lieutenant governor',
+	'governor & lieutenant governor',
+	'governor and lieutenant governor',
+	'secretary of state',
+	'attorney general',
+	'state\'s attorney',
+	'comptroller',
+	'treasurer',
+	'state senator',
+	'state representative',
+	'rep. in general assembly',
+	'rep. in gen. assembly',
+
+	# county
+	'commissioner',
+	'board president',
+	'president cook county board comm',
+	'clerk',
+	'sheriff',
+	'treasurer',
+	'assessor',
+	'commissioner, county board',
+	'board of review',
+	'recorder of deeds',
+
+	'supreme court',
+	'appellate court',
+	'apellate court',
+	'judge, cook county circuit',
+	'circuit court',
+	'circuit couut',
+	'subcircuit',
+
+	# city
+	'mayor',
+	'alderman',
+	'committeeman',
+]
+
+OFFICES_TO_SKIP = [
+	'ballots cast',
+	'registered voters',
+	'amendment',
+	'national convention',
+	'natl. convention',
+	'delegate natl',
+	'delegates natl',
+	'state central committeeman',
+	'state central',
+]
+
+class ContestClassifier(object):
+	"""
+	Sorts contest positions into ones to skip, known offices & the rest.
+
+	Built once: each table of substrings is one compiled regex. Whether an
+	unknown position is a person's name (a judge up for retention) or not
+	(a ballot measure) comes from the name cache, since the same positions
+	come up election after election.
+	"""
+
+	def __init__(self, known_offices=KNOWN_OFFICES, offices_to_skip=OFFICES_TO_SKIP):
+		self.known_offices = self._matcher(known_offices)
+		self.offices_to_skip = self._matcher(offices_to_skip)
+
+	def _matcher(self, substrings):
+		return re.compile('|'.join(re.escape(s) for s in substrings))
+
+	def match(self, position):
+		"""
+		'skip', 'office' or None, for a lowercased position
+		"""
+		if self.offices_to_skip.search(position):
+			return 'skip'
+		if self.known_offices.search(position):
+			return 'office'
+		return None
+
+	def is_person(self, position):
+		"""
+		Whether the name parser takes a lowercased position for a person's
+		name, or None if it can't tell
+		"""
+		tagged = NAME_CACHE.tag(position)
+		return tagged[1] == 'Person' if tagged else None
+
+CONTEST_CLASSIFIER = ContestClassifier()
+
+class LoadManifest(object):
+	"""
+	What was last loaded from each election file: its size, mtime & content
+	hash, & the election_id its RawResults were loaded under
+	"""
+
+	def __init__(self, filename='load_manifest.json'):
+		self.filename = filename
+		self.entries = {}
+		if os.path.exists(filename):
+			with open(filename) as f:
+				self.entries = json.load(f)
+
+	def fingerprint(self, path):
+		stat = os.stat(path)
+		return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+	def is_loaded(self, json_file, path):
+		"""
+		Whether the file is unchanged since it was loaded. Returns the file's
+		fingerprint too, to be recorded once it's loaded again.
+		"""
+		entry = self.entries.get(json_file)
+		fingerprint = self.fingerprint(path)
+		if entry and entry['size'] == fingerprint['size'] and entry['mtime'] == fingerprint['mtime']:
+			# kept, so the file can be recorded again (e.g. when forced)
+			# without hashing it; manifests that lost it get it back
+			fingerprint['sha1'] = entry.get('sha1') or self.content_hash(path)
+			return True, fingerprint
+
+		# the content hash is only worth computing once the cheap checks fail
+		fingerprint['sha1'] = self.content_hash(path)
+		if entry and entry.get('sha1') == fingerprint['sha1']:
+			# touched, but not changed
+			entry['mtime'] = fingerprint['mtime']
+			return True, fingerprint
+		return False, fingerprint
+
+	def content_hash(self, path):
+		sha1 = hashlib.sha1()
+		with open(path, 'rb') as f:
+			for chunk in iter(lambda: f.read(1024*1024), ''):
+				sha1.update(chunk)
+		return sha1.hexdigest()
+
+	def record(self, json_file, fingerprint, election_id):
+		self.entries[json_file] = dict(fingerprint, election_id=election_id)
+
+	def save(self):
+		tmp_filename = self.filename+'.tmp'
+		with open(tmp_filename, 'w') as f:
+			json.dump(self.entries, f, indent=4, sort_keys=True)
+		os.rename(tmp_filename, self.filename)
+
 class LoadResults(object):
 	"""
 	Entry point for data loading.
@@ -15,18 +181,125 @@ class LoadResults(object):
 	Determines appropriate loader for file and triggers load process.
 	"""
 
-	def run(self):
-
-		json_files = os.listdir('election_json')
+	def __init__(self, profile_dir=None, **loader_kwargs):
+		# if set, a report of the time & memory each stage of loading an
+		# election took is written here for each election
+		self.profile_dir = profile_dir
+		# passed on to each ChicagoLoader, e.g. chunk_size & ordered
+		self.loader_kwargs = loader_kwargs
+
+	def run(self, processes=1, force=False, manifest_file='load_manifest.json'):
+		"""
+		Loads the election files that changed since they were last loaded
+		(all of them if force is set), spread across processes if more than
+		one, & prints a report of how each election went
+		"""
+
+		manifest = LoadManifest(manifest_file)
+
+		# skips the .part files of elections still being scraped
+		json_files = []
+		fingerprints = {}
+		for json_file in os.listdir('election_json'):
+			if not json_file.endswith('.json'):
+				continue
+			is_loaded, fingerprints[json_file] = manifest.is_loaded(json_file, 'election_json/'+json_file)
+			if force or not is_loaded:
+				json_files.append(json_file)
+		num_unchanged = len(fingerprints) - len(json_files)
+
+		tasks = [(json_file, manifest.entries.get(json_file, {}).get('election_id'), self.profile_dir, self.loader_kwargs) for json_file in json_files]
+		if processes > 1:
+			# biggest first, so one large election doesn't start last
+			tasks.sort(key=lambda task: fingerprints[task[0]]['size'], reverse=True)
+
+			pool = multiprocessing.Pool(processes, initializer=_connect_worker)
+			try:
+				reports = pool.imap_unordered(_load_election, tasks)
+				reports = [self.record(manifest, fingerprints, report) for report in reports]
+			finally:
+				pool.close()
+				pool.join()
+		else:
+			reports = []
+			for json_file, previous_election_id, _, _ in tasks:
+				reports.append(self.record(manifest, fingerprints, self.load_file(json_file, previous_election_id)))
+
+		# picks up the mtimes of files touched but not changed
+		manifest.save()
+
+		self.print_report(reports, num_unchanged)
+		return reports
+
+	def record(self, manifest, fingerprints, report):
+		# saved as each election finishes, so an interrupted run doesn't
+		# reload what it already finished
+		if report['ok']:
+			manifest.record(report['filename'], fingerprints[report['filename']], report['election_id'])
+			manifest.save()
+		return report
+
+	def load_file(self, json_file, previous_election_id=None):
+		"""
+		Loads one election file, replacing whatever was loaded from it
+		before. Returns a report of how it went rather than raising, so one
+		bad election doesn't stop the rest.
+		"""
+		start = time.time()
+		profiler = StageProfiler() if self.profile_dir else NullProfiler()
+		report = {
+			'filename': json_file,
+			'election_name': None,
+			'election_id': None,
+			'ok': False,
+			'rows': 0,
+			'error': None,
+		}
 
-		for json_file in json_files:
-			with open('election_json/'+json_file) as f:
-				content = f.read()
-				election_json = json.loads(content)
-				elec_metadata = self.make_elec_metadata(election_json['election_name'], json_file)
-			
-			loader = ChicagoLoader()
-			loader.load(elec_metadata)
+		# the file is read once: the election name from the top, then
+		# the contests one at a time as they're loaded
+		reader = ElectionReader('election_json/'+json_file)
+		try:
+			with profiler.stage('read'):
+				report['election_name'] = reader.election_name
+			with profiler.stage('metadata'):
+				elec_metadata = self.make_elec_metadata(reader.election_name, json_file)
+
+			loader = ChicagoLoader(profiler=profiler, **self.loader_kwargs)
+			report['election_id'] = loader.make_election_id(elec_metadata)
+
+			election_ids = set([report['election_id'], previous_election_id]) - set([None])
+			with profiler.stage('delete'):
+				RawResult.objects(source=json_file, election_id__in=list(election_ids)).delete()
+
+			report['rows'] = loader.load(elec_metadata, reader.contests())
+			report['ok'] = True
+		except Exception:
+			report['error'] = traceback.format_exc()
+			print "FAILED TO LOAD:", json_file
+		finally:
+			reader.close()
+			NAME_CACHE.flush()
+
+		report['seconds'] = time.time() - start
+		if self.profile_dir:
+			profiler.write(os.path.join(self.profile_dir, json_file), election_id=report['election_id'], rows=report['rows'], ok=report['ok'])
+		return report
+
+	def print_report(self, reports, num_unchanged=0):
+		reports = sorted(reports, key=lambda r: r['filename'])
+		failed = [r for r in reports if not r['ok']]
+
+		print "*"*60
+		print "loaded %s of %s elections, %s rows" % (len(reports) - len(failed), len(reports), sum(r['rows'] for r in reports))
+		print "skipped %s unchanged elections" % num_unchanged
+		for report in reports:
+			print "%-8s %-60s %10s rows %8.1fs" % ('ok' if report['ok'] else 'FAILED', report['filename'], report['rows'], report['seconds'])
+		for report in failed:
+			print "-"*60
+			print report['filename']
+			print report['error']
+		print "*"*60
 
 	# metadata that we gather from the filename & the election name
 	def make_elec_metadata(self, election_name, filename):
@@ -91,9 +364,132 @@ class LoadResults(object):
 
 		return elec_metadata
 
+def _connect_worker():
+	# a forked process can't share its parent's datastore connection
+	get_db(reconnect=True)
+
+def _load_election(args):
+	json_file, previous_election_id, profile_dir, loader_kwargs = args
+	return LoadResults(profile_dir, **loader_kwargs).load_file(json_file, previous_election_id)
+
+# the fields of a RawResult that vary from row to row of a contest
+ROW_FIELDS = ('full_name', 'votes', 'reporting_level', 'jurisdiction')
+
+class RawDocumentTemplate(object):
+	"""
+	Builds the RawResult documents of one contest at one reporting level
+	without making a RawResult for every row, as they'd come out of
+	RawResult.objects.insert.
+
+	Fields that are the same for every row come from a RawResult made from
+	the first row. Fields the model derives (slugs & the like) are checked,
+	by changing one row field at a time, for which row fields they depend
+	on, & are worked out through the model once per distinct value of those.
+	"""
+
+	def __init__(self, contest_args, row_args):
+		self.contest_args = contest_args
+		self.template = self.build(row_args)
+		self.row_fields = [(name, RawResult._fields[name].db_field, RawResult._fields[name].to_mongo)
+			for name in ROW_FIELDS]
+
+		# fields that differ between two builds of the same row, e.g. a
+		# default of the current time; the first row's value stands in
+		self.volatile = self._differences(self.template, self.build(row_args))
+
+		derived = {}
+		row_db_fields = set(db_field for _, db_field, _ in self.row_fields)
+		for name in ROW_FIELDS:
+			changed = dict(row_args)
+			changed[name] = self._change(row_args[name])
+			for db_field in self._differences(self.template, self.build(changed)) - self.volatile - row_db_fields:
+				derived.setdefault(db_field, []).append(name)
+		self.derived = sorted((db_field, tuple(names)) for db_field, names in derived.items())
+		self._derived_values = {}
+		self._remember(row_args, self.template)
+
+	def build(self, row_args):
+		"""
+		A row's document, through the model
+		"""
+		result_args = dict(row_args)
+		result_args.update(self.contest_args)
+		raw_result = RawResult(**result_args)
+		signals.pre_bulk_insert.send(RawResult, documents=[raw_result])
+		return dict(raw_result.to_mongo())
+
+	def document(self, row_args):
+		document = self.template.copy()
+		for name, db_field, to_mongo in self.row_fields:
+			document[db_field] = to_mongo(row_args[name])
+
+		for db_field, names in self.derived:
+			key = (db_field,) + tuple(row_args[name] for name in names)
+			if key not in self._derived_values:
+				self._remember(row_args, self.build(row_args))
+
+			value = self._derived_values[key]
+			if value is _MISSING:
+				document.pop(db_field, None)
+			else:
+				document[db_field] = value
+		return document
+
+	def _remember(self, row_args, built):
+		for db_field, names in self.derived:
+			key = (db_field,) + tuple(row_args[name] for name in names)
+			self._derived_values[key] = built.get(db_field, _MISSING)
+
+	def check(self, document, row_args):
+		"""
+		Validates a row through the model & raises if the document built for
+		it differs from the model's
+		"""
+		result_args = dict(row_args)
+		result_args.update(self.contest_args)
+		RawResult(**result_args).validate()
+
+		differences = self._differences(document, self.build(row_args)) - self.volatile
+		if differences:
+			raise ValueError('raw document differs from the model in %s: %s' % (sorted(differences), row_args))
+
+	def _differences(self, a, b):
+		return set(name for name in set(a) | set(b) if a.get(name, _MISSING) != b.get(name, _MISSING))
+
+	def _change(self, value):
+		if isinstance(value, basestring):
+			return value + u' x'
+		if isinstance(value, (int, long, float)):
+			return value + 1
+		return None
+
+_MISSING = object()
+
 class ChicagoLoader():
 
-	def load(self, elec_metadata):
+	def __init__(self, chunk_size=5000, ordered=True, classifier=CONTEST_CLASSIFIER, raw_documents=False, validate_every=1000, profiler=None):
+		# results are inserted chunk_size at a time as contests are read,
+		# so memory use doesn't grow with the size of the election
+		self.chunk_size = chunk_size
+		# unordered inserts let the datastore write a chunk in parallel,
+		# & carry on past a bad document instead of stopping at it
+		self.ordered = ordered
+		self.classifier = classifier
+		# builds plain documents from a few RawResults per contest & writes
+		# them straight to the collection, instead of making a RawResult
+		# for every row. post_bulk_insert isn't sent for them.
+		self.raw_documents = raw_documents
+		# with raw_documents, every validate_every'th row is still built
+		# through the model & checked against its document; 0 checks none
+		self.validate_every = validate_every
+		self._num_rows = 0
+		self.profiler = profiler or NullProfiler()
+
+	def load(self, elec_metadata, contests=None):
+		"""
+		Loads an election's contests, read from its json file unless
+		they're passed in
+		"""
 
 		chicago_args = {
 			'created': datetime.datetime.now(),
@@ -109,14 +505,18 @@ class ChicagoLoader():
 		}
 
 		results = []
+		num_inserted = 0
 
-		# loop through json, do stuff to add to kwargs
-		with open('election_json/'+elec_metadata['filename']) as f:
-			content = f.read()
-			election_json = json.loads(content)
+		reader = None
+		if contests is None:
+			reader = ElectionReader('election_json/'+elec_metadata['filename'])
+			contests = reader.contests()
+		contests = self.profiler.iterate('read', contests)
 
+		# loop through json, do stuff to add to kwargs
+		try:
 			seen_ballot_measure = False
-			for contest in election_json['contests']:
+			for contest in contests:
 
 				# for chicago election results, contests are always listed
 				# offices first, then judges, then ballot measures.
@@ -125,19 +525,46 @@ class ChicagoLoader():
 				# will use a name parser to identify a string as a name (therefore a judge) 
 				# or not a name (therefore a ballot measure). once one ballot measure is seen,
 				# the rest of the contests for that election are ballot measures
-				is_ballot_measure, contest_args = self.get_contest_args(chicago_args, contest['position'], seen_ballot_measure)
+				with self.profiler.stage('classify'):
+					is_ballot_measure, contest_args = self.get_contest_args(chicago_args, contest['position'], seen_ballot_measure)
 				if is_ballot_measure:
 					seen_ballot_measure = True
 
 				if contest_args:
 					# print "   loading contest:", contest['position']
-					contest_results = self.make_results(contest_args, contest['results'])
-					results.extend(contest_results)
+					if self.raw_documents:
+						contest_results = self.make_documents(contest_args, contest['results'])
+					else:
+						contest_results = self.make_results(contest_args, contest['results'])
+
+					for raw_result in self.profiler.iterate('build', contest_results):
+						results.append(raw_result)
+						if len(results) >= self.chunk_size:
+							num_inserted += self.insert(results)
+							results = []
 				else:
 					print "   contest not loaded:", contest['position']
+		finally:
+			if reader:
+				reader.close()
 
 		if results:
-			RawResult.objects.no_cache().insert(results)
+			num_inserted += self.insert(results)
+
+		return num_inserted
+
+	def insert(self, results):
+		with self.profiler.stage('insert'):
+			if self.raw_documents:
+				RawResult._get_collection().insert_many(results, ordered=self.ordered)
+			elif self.ordered:
+				RawResult.objects.no_cache().insert(results, load_bulk=False)
+			else:
+				# the signals RawResult.objects.insert would send
+				signals.pre_bulk_insert.send(RawResult, documents=results)
+				RawResult._get_collection().insert_many([r.to_mongo() for r in results], ordered=False)
+				signals.post_bulk_insert.send(RawResult, documents=results, loaded=False)
+		return len(results)
 
 	def make_election_id(self, elec_metadata):
 		d = elec_metadata['start_date'].strftime('%Y-%m-%d')
@@ -153,112 +580,75 @@ class ChicagoLoader():
 		# load known offices
 		# detect judge races & ballot initiatives
 
-		known_offices = [
-			# national
-			'president of the united states',
-			'president and vice president of the united states',
-			'pres and vice pres',
-			'president, u.s.',
-			'senator, u.s.',
-			'united states senator',
-			'u.s. senator',
-			'u.s. representative',
-			'representative in congress',
-			'rep. in congress',
-
-			# state
-			'governor',
-			'lieutenant governor',
-			'governor & lieutenant governor',
-			'governor and lieutenant governor',
-			'secretary of state',
-			'attorney general',
-			'state\'s attorney',
-			'comptroller',
-			'treasurer',
-			'state senator',
-			'state representative',
-			'rep. in general assembly',
-			'rep. in gen. assembly',
-
-			# county
-			'commissioner',
-			'board president',
-			'president cook county board comm',
-			'clerk',
-			'sheriff',
-			'treasurer',
-			'assessor',
-			'commissioner, county board',
-			'board of review',
-			'recorder of deeds',
-
-			'supreme court',
-			'appellate court',
-			'apellate court',
-			'judge, cook county circuit',
-			'circuit court',
-			'circuit couut',
-			'subcircuit',
-
-			# city
-			'mayor',
-			'alderman',
-			'committeeman',
-		]
-
-		offices_to_skip = [
-			'ballots cast',
-			'registered voters',
-			'amendment',
-			'national convention',
-			'natl. convention',
-			'delegate natl',
-			'delegates natl',
-			'state central committeeman',
-			'state central',
-		]
-
-		chicago_args['office'] = position.lower()
-
-		for office_substring in offices_to_skip:
-			if office_substring in position.lower():
-				return None, None
+		position = position.lower()
+		chicago_args['office'] = position
 
-		for office_substring in known_offices:
-			if office_substring in position.lower():
-				is_ballot_measure = False
-				if 'retain' in position.lower():
-					chicago_args['is_retention'] = True
-				return is_ballot_measure, chicago_args
+		kind = self.classifier.match(position)
+		if kind == 'skip':
+			return None, None
+
+		if kind == 'office':
+			is_ballot_measure = False
+			if 'retain' in position:
+				chicago_args['is_retention'] = True
+			return is_ballot_measure, chicago_args
 
 		if not seen_ballot_measure:
 			# at this point, an office is none of the above
-			try:
-				tokens, name_type = pp.tag(position.lower())
+			is_person = self.classifier.is_person(position)
 
-				if name_type == 'Person':
-					chicago_args['is_retention'] = True
-					is_ballot_measure = False
-					return is_ballot_measure, chicago_args
-				else:
-					chicago_args['is_ballot_measure'] = True
-					is_ballot_measure = True
-					return is_ballot_measure, chicago_args
-			except pp.RepeatedLabelError:
+			if is_person is None:
 				print "REPEATED LABEL ERROR"
 				return None, None
+			elif is_person:
+				chicago_args['is_retention'] = True
+				is_ballot_measure = False
+				return is_ballot_measure, chicago_args
+			else:
+				chicago_args['is_ballot_measure'] = True
+				is_ballot_measure = True
+				return is_ballot_measure, chicago_args
 
 		else:
 			chicago_args['is_ballot_measure'] = True
 			is_ballot_measure = True
 			return is_ballot_measure, chicago_args
 
-
-
 	def make_results(self, contest_args, results):
+		"""
+		Yields a RawResult for each ward & precinct result of a contest
+		"""
+
+		for row_args in self.result_rows(results):
+			result_args = dict(row_args)
+			result_args.update(contest_args)
+			yield RawResult(**result_args)
+
+	def make_documents(self, contest_args, results):
+		"""
+		Yields the same results as make_results, as documents ready for the
+		collection; see RawDocumentTemplate
+		"""
+
+		# ward & precinct rows can have different fields derived for them
+		templates = {}
+		for row_args in self.result_rows(results):
+			self._num_rows += 1
+			template = templates.get(row_args['reporting_level'])
+			if template is None:
+				template = templates[row_args['reporting_level']] = RawDocumentTemplate(contest_args, row_args)
+
+			document = template.document(row_args)
+			if self.validate_every and self._num_rows % self.validate_every == 0:
+				template.check(document, row_args)
+			yield document
+
+	def result_rows(self, results):
+		"""
+		Yields the fields particular to each ward & precinct result row of
+		a contest
+		"""
 
-		raw_result_list = []
 		for result in results:
 
 			result_jurisdiction = "ward %s" % result['ward']
@@ -272,8 +662,7 @@ class ChicagoLoader():
 					'reporting_level': 'municipal_district',
 					'jurisdiction': result_jurisdiction,
 				}
-				result_args.update(contest_args)
-				raw_result_list.append(RawResult(**result_args))
+				yield result_args
 
 			# adding precinct results
 			for precinct_result in result['results_by_precinct']:
@@ -288,9 +677,4 @@ class ChicagoLoader():
 						'reporting_level': 'precinct',
 						'jurisdiction': result_jurisdiction,
 					}
-
-				result_args.update(contest_args)
-				raw_result_list.append(RawResult(**result_args))
-
-		return raw_result_list
-
+					yield result_args
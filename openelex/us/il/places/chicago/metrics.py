@@ -0,0 +1,101 @@
+import json
+import time
+import threading
+
+URL_CLASSES = ['election menu', 'contest menu', 'ward page']
+CACHE_STATES = ['hit', 'revalidated', 'miss']
+
+class ScrapeMetrics(object):
+    """
+    Collects per-request & per-contest measurements over a scrape run &
+    summarizes them (totals & latency percentiles) for scrape_metrics.json
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._requests = dict((url_class, _RequestStats()) for url_class in URL_CLASSES)
+        self._parse_seconds = []
+        self._parsed_wards = 0
+
+    def record_request(self, url_class, seconds, num_bytes, cache, retries=0, error=False):
+        with self._lock:
+            self._requests[url_class].add(seconds, num_bytes, cache, retries, error)
+
+    def record_fallback(self, url_class):
+        """
+        A page the site answered with an error, kept anyway
+        """
+        with self._lock:
+            self._requests[url_class].fallbacks += 1
+
+    def record_parse(self, contest_name, seconds, num_wards):
+        with self._lock:
+            self._parse_seconds.append(seconds)
+            self._parsed_wards += num_wards
+
+    def summary(self, **extra):
+        with self._lock:
+            summary = {
+                'elapsed_seconds': time.time() - self.started,
+                'requests': dict((url_class, stats.summary()) for url_class, stats in self._requests.items()),
+                'parse': {
+                    'contests': len(self._parse_seconds),
+                    'wards': self._parsed_wards,
+                    'total_seconds': sum(self._parse_seconds),
+                    'seconds_per_contest': percentiles(self._parse_seconds),
+                },
+            }
+        summary['requests']['total'] = {
+            'count': sum(s['count'] for s in summary['requests'].values()),
+            'bytes': sum(s['bytes'] for s in summary['requests'].values()),
+            'total_seconds': sum(s['total_seconds'] for s in summary['requests'].values()),
+        }
+        summary.update(extra)
+        return summary
+
+    def write(self, filename, **extra):
+        with open(filename, 'w') as f:
+            json.dump(self.summary(**extra), f, indent=4, sort_keys=True)
+
+
+class _RequestStats(object):
+
+    def __init__(self):
+        self.latencies = []
+        self.bytes = 0
+        self.cache = dict((state, 0) for state in CACHE_STATES)
+        self.retries = 0
+        self.fallbacks = 0
+        self.errors = 0
+
+    def add(self, seconds, num_bytes, cache, retries, error):
+        self.latencies.append(seconds)
+        self.bytes += num_bytes
+        self.cache[cache] += 1
+        self.retries += retries
+        self.errors += int(error)
+
+    def summary(self):
+        return {
+            'count': len(self.latencies),
+            'bytes': self.bytes,
+            'total_seconds': sum(self.latencies),
+            'latency_seconds': percentiles(self.latencies),
+            'cache': dict(self.cache),
+            'retries': self.retries,
+            'fallbacks': self.fallbacks,
+            'errors': self.errors,
+        }
+
+
+def percentiles(values, points=(50, 90, 99)):
+    """
+    Nearest-rank percentiles, plus the max
+    """
+    if not values:
+        return {}
+    values = sorted(values)
+    result = dict(('p%s' % p, values[min(len(values)-1, int(len(values)*p/100.0))]) for p in points)
+    result['max'] = values[-1]
+    return result
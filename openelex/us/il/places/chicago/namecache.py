@@ -0,0 +1,175 @@
+"""
+Disk-backed cache of probablepeople's name tagging, shared by the loader &
+the transforms across processes & runs.
+
+Entries are kept in a sqlite database along with the cache version & the
+probablepeople version that tagged them; if either changes, the cache
+starts over. Once it holds more than max_entries, the least recently used
+are evicted. The memory_size most recently used are also kept in memory.
+
+Each write is committed as it's made, & the database is in WAL mode, so
+processes tagging names at the same time don't hold each other up & a
+process that exits has already saved what it tagged.
+"""
+import os
+import json
+import time
+import sqlite3
+import multiprocessing
+import pkg_resources
+from collections import OrderedDict
+
+import probablepeople as pp
+
+NAME_CACHE_VERSION = 1
+
+def _probablepeople_version():
+    try:
+        return pkg_resources.get_distribution('probablepeople').version
+    except pkg_resources.DistributionNotFound:
+        return ''
+
+class NameCache(object):
+
+    def __init__(self, filename='.name_cache.sqlite', max_entries=500000, check_size_every=500, memory_size=10000):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.check_size_every = check_size_every
+        self.memory_size = memory_size
+        self.version = '%s-%s' % (NAME_CACHE_VERSION, _probablepeople_version())
+
+        self._names = OrderedDict()
+        self._db = None
+        self._pid = None
+        self._inserted = 0
+
+    def tag(self, name):
+        """
+        pp.tag(name), or None where it raises RepeatedLabelError
+        """
+        try:
+            # most recently used last
+            tagged = self._names[name] = self._names.pop(name)
+            return tagged
+        except KeyError:
+            pass
+
+        row = self._connect().execute('SELECT tokens, name_type FROM names WHERE name = ?', (name,)).fetchone()
+        if row:
+            tagged = self._decode(row)
+            self._write([('UPDATE names SET last_used = ? WHERE name = ?', (time.time(), name))])
+        else:
+            tagged = _tag(name)[1]
+            self._store([(name, tagged)])
+
+        self._names[name] = tagged
+        if len(self._names) > self.memory_size:
+            self._names.popitem(last=False)
+        return tagged
+
+    def prewarm(self, names, processes=None):
+        """
+        Tags, in parallel, every name not already cached
+        """
+        names = set(names) - set(self._names)
+        missing = []
+        db = self._connect()
+        names = list(names)
+        for i in range(0, len(names), 500):
+            batch = names[i:i+500]
+            found = set(row[0] for row in db.execute(
+                'SELECT name FROM names WHERE name IN (%s)' % ','.join('?' * len(batch)), batch))
+            missing.extend(name for name in batch if name not in found)
+
+        if not missing:
+            return 0
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            tagged = pool.map(_tag, missing, chunksize=max(1, len(missing) // (4 * (processes or multiprocessing.cpu_count()))))
+        finally:
+            pool.close()
+            pool.join()
+
+        self._store(tagged)
+        self._check_size()
+        return len(missing)
+
+    def flush(self):
+        # writes are committed as they're made; this is for anything a
+        # failed write left open
+        if self._db:
+            self._db.commit()
+
+    def close(self):
+        if self._db:
+            self.flush()
+            self._db.close()
+            self._db = None
+
+    def _connect(self):
+        # a connection can't be shared with forked processes
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.filename, timeout=60)
+            self._pid = os.getpid()
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS names '
+                             '(name TEXT PRIMARY KEY, tokens TEXT, name_type TEXT, last_used REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS names_last_used ON names (last_used)')
+
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if not row or row[0] != self.version:
+                self._db.execute('DELETE FROM names')
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (self.version,))
+            self._db.commit()
+        return self._db
+
+    def _store(self, tagged_names):
+        now = time.time()
+        rows = []
+        for name, tagged in tagged_names:
+            if tagged is None:
+                rows.append((name, None, None, now))
+            else:
+                rows.append((name, json.dumps(list(tagged[0].items())), tagged[1], now))
+        self._write([('INSERT OR REPLACE INTO names VALUES (?, ?, ?, ?)', row) for row in rows])
+        self._inserted += len(rows)
+
+        # counting the entries after every insert would cost more than the
+        # insert itself
+        if self._inserted >= self.check_size_every:
+            self._check_size()
+
+    def _check_size(self):
+        self._inserted = 0
+        count = self._connect().execute('SELECT COUNT(*) FROM names').fetchone()[0]
+        if count > self.max_entries:
+            # down to 90% of the cap so we don't evict on every insert
+            excess = count - int(self.max_entries * 0.9)
+            self._write([('DELETE FROM names WHERE name IN '
+                          '(SELECT name FROM names ORDER BY last_used LIMIT ?)', (excess,))])
+
+    def _write(self, statements):
+        # one short transaction, so the write lock isn't held between calls
+        db = self._connect()
+        with db:
+            for sql, params in statements:
+                db.execute(sql, params)
+
+    def _decode(self, row):
+        tokens, name_type = row
+        if name_type is None:
+            return None
+        return OrderedDict(json.loads(tokens)), name_type
+
+
+def _tag(name):
+    # runs in the prewarm processes too
+    try:
+        return name, pp.tag(name)
+    except pp.RepeatedLabelError:
+        return name, None
+
+# the cache shared by the loader & the transforms
+NAME_CACHE = NameCache()
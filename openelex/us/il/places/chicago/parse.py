@@ -0,0 +1,206 @@
+import os
+import json
+import zlib
+import shutil
+import threading
+
+import lxml.html
+
+from openelex.us.il.places.chicago.cache import content_hash
+
+# bump whenever parse_ward_table's output changes, so pages parsed by the
+# old version aren't served from the parse cache
+PARSER_VERSION = 1
+
+# what the site says, lowercased, instead of giving results for a ward
+BROKEN_PAGE = 'ward, election selected or contest was bad'
+
+def parse_ward_table(page):
+    """
+    Parses the results table of a ward results page into its header row,
+    precinct rows & column totals.
+
+    The table is walked once & the text of each cell is read once.
+    Precinct rows are the rows after the header, up to (not including) the
+    last 'Total' row, b/c sometimes there are extra non-result rows after
+    it. A column's total is None if any of its cells isn't an integer,
+    e.g. the percentage columns.
+    """
+    tree = lxml.html.fromstring(page)
+
+    header = []
+    cells = []
+    total_at = None
+    for i, tr in enumerate(tree.xpath("//table[1]//tr")):
+        row = [td.text_content() for td in tr.iterchildren('td')]
+        if row and row[0] == 'Total':
+            total_at = len(cells)
+        if i == 1:
+            header = row
+        elif i > 1:
+            cells.extend(row)
+
+    num_cols = len(header)
+    if not num_cols:
+        return header, [], []
+
+    if total_at is not None:
+        cells = cells[:total_at]
+    rows = [cells[i:i+num_cols] for i in range(0, len(cells), num_cols)]
+
+    totals = []
+    if rows:
+        totals = [0] * len(rows[0])
+        for row in rows:
+            for i, total in enumerate(totals):
+                if total is not None:
+                    try:
+                        totals[i] = total + int(row[i])
+                    except (ValueError, IndexError):
+                        totals[i] = None
+
+    return header, rows, totals
+
+
+class ParseCache(object):
+    """
+    On-disk cache of parse_ward_table's output, keyed by a hash of the page
+    & kept in a directory per parser version, so a page that hasn't changed
+    is only ever parsed once.
+
+    Directories of other parser versions are removed. Once the cache grows
+    past max_bytes the least recently used entries are evicted; the size is
+    checked every check_every writes rather than tracked, since the parse
+    processes of a pipelined scrape each write to it.
+    """
+
+    def __init__(self, cache_dir='.parse_cache', version=PARSER_VERSION, max_bytes=512*1024**2, check_every=500):
+        self.cache_dir = os.path.join(cache_dir, str(version))
+        self.max_bytes = max_bytes
+        self.check_every = check_every
+        self._writes = 0
+
+        if not os.path.exists(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                # made by another parse process in the meantime
+                if not os.path.isdir(self.cache_dir):
+                    raise
+
+        for name in os.listdir(cache_dir):
+            if name != str(version):
+                shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+
+    def parse(self, page):
+        path = os.path.join(self.cache_dir, content_hash(page.encode('utf-8'))+'.gz')
+        try:
+            with open(path, 'rb') as f:
+                header, rows, totals = json.loads(zlib.decompress(f.read()))
+            # the mtime is what eviction goes by
+            os.utime(path, None)
+            return header, rows, totals
+        except (IOError, OSError, ValueError, zlib.error):
+            pass
+
+        parsed = parse_ward_table(page)
+        tmp_path = '%s.%s.%s.tmp' % (path, os.getpid(), threading.current_thread().ident)
+        with open(tmp_path, 'wb') as f:
+            f.write(zlib.compress(json.dumps(parsed)))
+        os.rename(tmp_path, path)
+
+        self._writes += 1
+        if self._writes >= self.check_every:
+            self._writes = 0
+            self._evict()
+        return parsed
+
+    def _evict(self):
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        if total_bytes <= self.max_bytes:
+            return
+
+        # drop down to 90% of the cap so we don't evict on every check
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(entries):
+            if total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_bytes -= size
+
+
+def ward_json(contest_name, ward, url, page, parse_cache=None):
+    """
+    Returns the results for one ward of a contest, built from its results
+    page, or None if the page is broken or has no precinct results
+    """
+
+    if BROKEN_PAGE in page.lower():
+        print "*"*60
+        print "ERROR: BROKEN RESULTS PAGE"
+        print "url: %s" % url
+        print "*"*60
+    else:
+
+        if parse_cache:
+            tbl_header, precinct_data, totals = parse_cache.parse(page)
+        else:
+            tbl_header, precinct_data, totals = parse_ward_table(page)
+        num_cols = len(tbl_header)
+
+        if precinct_data:
+            # TO-DO: distinguish between voting on candidates vs voting on Y/N vote?
+            if len(tbl_header) > 2: # more than one candidate running
+                candidates = tbl_header[2::2]
+                votes_totals = totals[2::2]
+            else: # only one candidate
+                candidates = [tbl_header[1]]
+                votes_totals = [totals[1]]
+
+            results_by_precinct = []
+            for row_string in precinct_data:
+                precinct = row_string[0]
+
+                precinct_result = {
+                    'precinct': precinct,
+                    'candidate_totals': {}
+                }
+                if num_cols > 2:
+                    votes_precinct = row_string[2::2]
+                else: # only one candidate
+                    votes_precinct = [row_string[1]]
+
+                for candidate, vote in zip(candidates, votes_precinct):
+                    precinct_result['candidate_totals'][candidate] = int(vote)
+
+                results_by_precinct.append(precinct_result)
+
+            candidate_totals = {}
+            for candidate, votes_total in zip(candidates, votes_totals):
+                candidate_totals[candidate] = int(votes_total)
+
+            ward_result = {
+                'ward': ward,
+                'candidate_totals': candidate_totals,
+                'results_by_precinct': results_by_precinct
+            }
+
+            return ward_result
+        else:
+            print "*"*60
+            print "ERROR: MISSING PRECINCT LEVEL DATA"
+            print "contest: %s" % contest_name
+            print "ward: %s" % ward
+            print "*"*60
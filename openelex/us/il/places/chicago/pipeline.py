@@ -0,0 +1,278 @@
+"""
+Runs a scrape as four stages connected by bounded queues, so that menu
+POSTs, ward page downloads, html parsing & file writes all overlap:
+
+    discovery -> fetch -> parse -> write
+
+discovery   one thread POSTing the election & contest menus, handing each
+            contest's ward pages to the fetchers as soon as its menu is in
+fetch       a pool of threads downloading ward pages through the scraper,
+            so they share its throttle & cache
+parse       a pool of processes turning ward pages into ward results
+write       the calling thread, putting each election's contests back in
+            order & streaming them to disk (with checkpoints) as they finish
+
+Usage:
+    python -m openelex.us.il.places.chicago.pipeline [--fetch-workers N] [--parse-processes N]
+"""
+import os
+import time
+import argparse
+import threading
+import traceback
+import multiprocessing
+import Queue
+
+from openelex.us.il.places.chicago.checkpoint import Checkpoint
+from openelex.us.il.places.chicago.parse import ward_json
+from openelex.us.il.places.chicago.scraper import Scraper
+
+SUMMARY_CONTESTS = ['REGISTERED VOTERS - TOTAL', 'BALLOTS CAST - ']
+
+def _parse_ward(args):
+    # runs in the parse processes; errors are sent back rather than raised so
+    # the writer can stop the run instead of waiting on a ward that never comes
+    start = time.time()
+    try:
+        return True, (ward_json(*args), time.time() - start)
+    except Exception:
+        return False, traceback.format_exc()
+
+
+class _Election(object):
+    """
+    Write-stage bookkeeping for one election
+    """
+
+    def __init__(self, slug, elec_name, writers, checkpoint, recorded_names):
+        self.slug = slug
+        self.elec_name = elec_name
+        self.writers = writers
+        self.checkpoint = checkpoint
+        self.num_contests = None
+
+        self.contests = {}
+        self.next_contest = 0
+        # recorded contests, read back one at a time as they're written
+        self.recorded = checkpoint.resume(recorded_names) if recorded_names else None
+
+
+class _Contest(object):
+
+    def __init__(self, contest_name, num_wards, resumed):
+        self.contest_name = contest_name
+        self.num_wards = num_wards
+        self.resumed = resumed
+        self.wards = {}
+        self.parse_seconds = 0
+
+    def is_complete(self):
+        return self.resumed or len(self.wards) == self.num_wards
+
+
+class ScrapePipeline(object):
+
+    def __init__(self, scraper, fetch_workers=4, parse_processes=2, queue_size=200):
+        self.scraper = scraper
+        self.fetch_workers = fetch_workers
+        if scraper.pool_maxsize <= fetch_workers:
+            # room for every fetcher plus discovery, so no connection
+            # gets thrown away for lack of a free slot in the pool
+            scraper.mount_pool(scraper.pool_connections, fetch_workers+1)
+        self.parse_processes = parse_processes
+
+        self._fetch_queue = Queue.Queue(queue_size)
+        self._parse_queue = Queue.Queue(queue_size)
+        self._write_queue = Queue.Queue(queue_size)
+        self._parsing = threading.BoundedSemaphore(queue_size)
+
+    def run(self):
+        # the pool is forked before any threads are started
+        pool = multiprocessing.Pool(self.parse_processes) if self.parse_processes else None
+
+        threads = [threading.Thread(target=self._discover)]
+        threads += [threading.Thread(target=self._fetch) for _ in range(self.fetch_workers)]
+        threads.append(threading.Thread(target=self._parse, args=(pool,)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            self._write()
+        finally:
+            if pool:
+                pool.terminate()
+
+        self.scraper.print_connection_stats()
+        self.scraper.write_metrics()
+
+    def _discover(self):
+        try:
+            for elec_name in self.scraper.election_names():
+                print 'ELECTION', elec_name
+                name = elec_name[5:]
+                slug = self.scraper.election_slug(name)
+                if os.path.exists(self.scraper.election_filename(slug)):
+                    continue
+
+                checkpoint = Checkpoint(slug)
+                recorded_names = checkpoint.contest_names()
+                self._write_queue.put(('election', slug, name, checkpoint, recorded_names))
+
+                # contests at the start of the election that are already
+                # in the checkpoint aren't fetched again
+                resuming = True
+                num_contests = 0
+                for contest_name, contest_urls in self.scraper.contest_urls(elec_name):
+                    if any(summary in contest_name for summary in SUMMARY_CONTESTS):
+                        continue
+
+                    resuming = resuming and num_contests < len(recorded_names) and recorded_names[num_contests] == contest_name
+                    self._write_queue.put(('contest', slug, num_contests, contest_name, len(contest_urls), resuming))
+                    if not resuming:
+                        for ward_num, (ward, url) in enumerate(contest_urls):
+                            self._fetch_queue.put((slug, num_contests, ward_num, contest_name, ward, url))
+                    num_contests += 1
+
+                self._write_queue.put(('election_end', slug, num_contests))
+        except Exception:
+            self._write_queue.put(('error', traceback.format_exc()))
+        finally:
+            for _ in range(self.fetch_workers):
+                self._fetch_queue.put(None)
+
+    def _fetch(self):
+        try:
+            while True:
+                task = self._fetch_queue.get()
+                if task is None:
+                    break
+                slug, contest_num, ward_num, contest_name, ward, url = task
+                page = self.scraper.fetch_ward_page(contest_name, ward, url)
+                self._parse_queue.put((slug, contest_num, ward_num, (contest_name, ward, url, page, self.scraper.parse_cache)))
+        except Exception:
+            self._write_queue.put(('error', traceback.format_exc()))
+        finally:
+            self._parse_queue.put(None)
+
+    def _parse(self, pool):
+        try:
+            fetchers_done = 0
+            while fetchers_done < self.fetch_workers:
+                task = self._parse_queue.get()
+                if task is None:
+                    fetchers_done += 1
+                    continue
+
+                slug, contest_num, ward_num, args = task
+                if pool:
+                    # bounds the number of pages waiting on the pool
+                    self._parsing.acquire()
+                    callback = self._parsed_callback(slug, contest_num, ward_num)
+                    pool.apply_async(_parse_ward, (args,), callback=callback)
+                else:
+                    ok, result = _parse_ward(args)
+                    self._write_queue.put(('ward', slug, contest_num, ward_num, ok, result))
+
+            if pool:
+                pool.close()
+                pool.join()
+        except Exception:
+            self._write_queue.put(('error', traceback.format_exc()))
+        finally:
+            self._write_queue.put(('done',))
+
+    def _parsed_callback(self, slug, contest_num, ward_num):
+        def callback(parsed):
+            self._parsing.release()
+            ok, result = parsed
+            self._write_queue.put(('ward', slug, contest_num, ward_num, ok, result))
+        return callback
+
+    def _write(self):
+        elections = {}
+        while True:
+            message = self._write_queue.get()
+            kind = message[0]
+
+            if kind == 'done':
+                break
+            elif kind == 'error':
+                raise RuntimeError('scrape pipeline failed:\n%s' % message[1])
+            elif kind == 'election':
+                _, slug, elec_name, checkpoint, recorded_names = message
+                writers = self.scraper.election_writers(slug, elec_name)
+                elections[slug] = _Election(slug, elec_name, writers, checkpoint, recorded_names)
+            elif kind == 'contest':
+                _, slug, contest_num, contest_name, num_wards, resumed = message
+                elections[slug].contests[contest_num] = _Contest(contest_name, num_wards, resumed)
+            elif kind == 'ward':
+                _, slug, contest_num, ward_num, ok, result = message
+                if not ok:
+                    raise RuntimeError('parsing a ward page failed:\n%s' % result)
+                contest = elections[slug].contests[contest_num]
+                contest.wards[ward_num], parse_seconds = result
+                contest.parse_seconds += parse_seconds
+            elif kind == 'election_end':
+                _, slug, num_contests = message
+                elections[slug].num_contests = num_contests
+
+            if kind in ('contest', 'ward', 'election_end'):
+                if self._flush(elections[slug]):
+                    del elections[slug]
+
+        if elections:
+            raise RuntimeError('scrape pipeline ended with unfinished elections: %s' % ', '.join(elections))
+
+    def _flush(self, election):
+        """
+        Writes out any contests that are now complete & next in line.
+        Returns True once the whole election has been written.
+        """
+        while election.next_contest in election.contests and election.contests[election.next_contest].is_complete():
+            contest = election.contests.pop(election.next_contest)
+
+            if contest.resumed:
+                contest_json = next(election.recorded)
+            else:
+                if election.recorded is not None:
+                    # first contest past the checkpoint; drop whatever
+                    # was recorded beyond it
+                    election.recorded.close()
+                    election.recorded = None
+                    election.checkpoint.truncate(election.next_contest)
+
+                print '  CONTEST', contest.contest_name
+                contest_json = {
+                    'position': contest.contest_name,
+                    'results': [contest.wards[i] for i in range(contest.num_wards) if contest.wards[i]]
+                }
+                election.checkpoint.record(contest.contest_name, contest_json)
+                self.scraper.metrics.record_parse(contest.contest_name, contest.parse_seconds, contest.num_wards)
+
+            for writer in election.writers:
+                writer.write_contest(contest_json)
+            election.next_contest += 1
+
+        if election.num_contests is not None and election.next_contest == election.num_contests:
+            if election.recorded is not None:
+                election.recorded.close()
+            for writer in election.writers:
+                writer.close()
+            election.checkpoint.clear()
+            self.scraper.write_metrics()
+            return True
+
+        return False
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fetch-workers', type=int, default=4)
+    parser.add_argument('--parse-processes', type=int, default=2)
+    args = parser.parse_args()
+
+    if not os.path.exists('election_json'):
+        os.makedirs('election_json')
+
+    ScrapePipeline(Scraper(), args.fetch_workers, args.parse_processes).run()
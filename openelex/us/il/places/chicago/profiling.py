@@ -0,0 +1,157 @@
+"""
+Per-stage time & memory accounting for loading an election.
+
+Each stage records how long it took, how many times it ran, how much the
+process's resident memory grew while it was running & the highest it got,
+and how many more objects the garbage collector was tracking afterwards.
+The peak is what points at the stage that pushes an election over a
+memory limit.
+
+Memory is read from /proc: the current RSS from /proc/self/statm, & the
+peak from VmHWM in /proc/self/status, which is reset at the start of each
+stage (by writing 5 to /proc/self/clear_refs) so it's the stage's own
+peak rather than the biggest election's so far. Where /proc isn't there,
+only the RSS at the start & end of each stage is seen.
+
+Stages run once per row (see iterate) are timed on every row but only
+measured for memory & objects on every sample_every'th, since measuring
+costs more than building a row; sampled_calls says how many were.
+"""
+import os
+import gc
+import json
+import time
+import resource
+from contextlib import contextmanager
+
+PAGE_KB = os.sysconf('SC_PAGE_SIZE') // 1024
+
+class StageProfiler(object):
+
+    def __init__(self, count_objects=True, sample_every=100):
+        # counting objects walks every object the collector tracks
+        self.count_objects = count_objects
+        self.sample_every = sample_every
+
+        self.started = time.time()
+        self.stages = {}
+        self._start_rss = self._rss()
+        self._can_reset_peak = self._reset_peak()
+
+    @contextmanager
+    def stage(self, name):
+        before = self._start(self.count_objects)
+        try:
+            yield
+        finally:
+            self._add(name, before, self._end(self.count_objects))
+
+    def iterate(self, name, iterable):
+        """
+        Yields from iterable, counting the time spent producing each item
+        towards the stage
+        """
+        iterator = iter(iterable)
+        num_items = 0
+        while True:
+            sampled = num_items % self.sample_every == 0
+            before = self._start(self.count_objects) if sampled else (time.time(), None, None)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self._add(name, before, self._end(self.count_objects) if sampled else (time.time(), None, None, None))
+            num_items += 1
+            yield item
+
+    def report(self, **extra):
+        peaks = [stage['peak_rss_kb'] for stage in self.stages.values()]
+        report = {
+            'seconds': time.time() - self.started,
+            'peak_rss_kb': max(peaks + [self._rss()]),
+            'rss_growth_kb': self._rss() - self._start_rss,
+            'stages': self.stages,
+        }
+        report.update(extra)
+        return report
+
+    def write(self, filename, **extra):
+        report = self.report(**extra)
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+
+    def _start(self, count_objects):
+        objects = len(gc.get_objects()) if count_objects else None
+        rss = self._rss()
+        # after the object count, which allocates a list of every object
+        if self._can_reset_peak:
+            self._reset_peak()
+        return time.time(), rss, objects
+
+    def _end(self, count_objects):
+        # before the object count, for the same reason
+        finished = time.time()
+        peak = self._peak() if self._can_reset_peak else None
+        rss = self._rss()
+        objects = len(gc.get_objects()) if count_objects else None
+        return finished, rss, objects, peak
+
+    def _add(self, name, before, after):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = {
+                'calls': 0,
+                'seconds': 0.0,
+                'rss_growth_kb': 0,
+                'peak_rss_kb': 0,
+                'object_growth': 0 if self.count_objects else None,
+                'sampled_calls': 0,
+            }
+        stage['calls'] += 1
+        stage['seconds'] += after[0] - before[0]
+        if before[1] is None:
+            return
+
+        stage['sampled_calls'] += 1
+        stage['rss_growth_kb'] += after[1] - before[1]
+        peak = after[3] if after[3] is not None else max(before[1], after[1])
+        stage['peak_rss_kb'] = max(stage['peak_rss_kb'], peak)
+        if before[2] is not None:
+            stage['object_growth'] += after[2] - before[2]
+
+    def _rss(self):
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * PAGE_KB
+        except IOError:
+            # the peak so far, which is the best there is without /proc
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def _peak(self):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+
+    def _reset_peak(self):
+        try:
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+            return self._peak() is not None
+        except IOError:
+            return False
+
+
+class NullProfiler(object):
+    """
+    Stands in for a StageProfiler when not profiling
+    """
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def iterate(self, name, iterable):
+        return iterable
@@ -0,0 +1,177 @@
+import re
+import json
+import codecs
+
+WHITESPACE = re.compile(r'\s*')
+STRUCTURE = re.compile(r'["\[\]{}]')
+# the rest of a string, from just after its opening quote
+STRING_REST = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+
+class ElectionReader(object):
+    """
+    Reads an election json file incrementally, one contest at a time, so
+    only one contest is ever in memory.
+
+    ElectionWriter puts the election name before the contests, so reading
+    the name & then the contests reads the file once. Files written before
+    that (json.dump, in py2, puts the name last) have the contests first;
+    for those, finding the name means scanning past the contests without
+    decoding them, & they're read again from the start.
+    """
+
+    def __init__(self, filename, chunk_size=64*1024):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._open()
+
+    @property
+    def election_name(self):
+        self._finding_name = True
+        try:
+            while 'election_name' not in self.fields:
+                try:
+                    kind, _ = next(self._events)
+                except StopIteration:
+                    break
+                if kind in ('contest', 'skipped contests'):
+                    self._skipped_contests = True
+        finally:
+            self._finding_name = False
+        return self.fields.get('election_name')
+
+    def contests(self):
+        if self._skipped_contests:
+            self.close()
+            self._open()
+
+        for kind, value in self._events:
+            if kind == 'contest':
+                yield value
+
+    def close(self):
+        self._file.close()
+
+    def _open(self):
+        self.fields = {}
+        self._file = open(self.filename, 'rb')
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = u''
+        self._pos = 0
+        self._skipped_contests = False
+        self._finding_name = False
+        self._events = self._parse()
+
+    def _parse(self):
+        # walks the top-level object, yielding ('field', key) after each of
+        # its other values & ('contest', contest) for each contest, or
+        # ('skipped contests', None) if they're passed over while finding
+        # the election name
+        self._expect('{')
+        if self._peek() == '}':
+            return
+
+        while True:
+            key = self._decode()
+            self._expect(':')
+
+            if key == 'contests' and self._finding_name:
+                self._skip()
+                yield 'skipped contests', None
+            elif key == 'contests':
+                self._expect('[')
+                if self._peek() == ']':
+                    self._pos += 1
+                else:
+                    while True:
+                        yield 'contest', self._decode()
+                        if self._separator(']'):
+                            break
+            else:
+                self.fields[key] = self._decode()
+                yield 'field', key
+
+            if self._separator('}'):
+                return
+
+    def _fill(self):
+        # reads at least as much again as is buffered, so decoding a large
+        # contest isn't retried once per chunk
+        data = self._file.read(max(self.chunk_size, len(self._buffer) - self._pos))
+        self._buffer = self._buffer[self._pos:] + self._text.decode(data, final=not data)
+        self._pos = 0
+        return bool(data)
+
+    def _peek(self):
+        while True:
+            self._pos = WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError('%s ends unexpectedly' % self.filename)
+
+    def _next(self):
+        char = self._peek()
+        self._pos += 1
+        return char
+
+    def _expect(self, char):
+        found = self._next()
+        if found != char:
+            raise ValueError('expected %r but found %r in %s' % (char, found, self.filename))
+
+    def _separator(self, close):
+        # True at the end of an object or array, False after a comma
+        found = self._next()
+        if found not in (',', close):
+            raise ValueError('expected , or %s but found %r in %s' % (close, found, self.filename))
+        return found == close
+
+    def _skip(self):
+        # moves past a value without decoding it, only following its
+        # strings & nesting
+        if self._peek() not in '[{"':
+            self._decode()
+            return
+
+        depth = 0
+        while True:
+            match = STRUCTURE.search(self._buffer, self._pos)
+            if match is None:
+                self._pos = len(self._buffer)
+                if not self._fill():
+                    raise ValueError('%s ends unexpectedly' % self.filename)
+                continue
+
+            char = match.group()
+            if char == '"':
+                end = STRING_REST.match(self._buffer, match.end())
+                if end is None:
+                    # the string is cut off at the end of the buffer
+                    self._pos = match.start()
+                    if not self._fill():
+                        raise ValueError('%s ends unexpectedly' % self.filename)
+                    continue
+                self._pos = end.end()
+            else:
+                self._pos = match.end()
+                depth += 1 if char in '[{' else -1
+
+            if depth == 0:
+                return
+
+    def _decode(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                # the value is cut off at the end of the buffer
+                if not self._fill():
+                    raise
+                continue
+            # so is a number that runs to the end of the buffer
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
@@ -0,0 +1,247 @@
+"""
+Record-and-replay for the scraper.
+
+A Scraper given record_to appends every request it makes & the response it
+got (POST bodies included) to a single gzipped archive. The archive can
+then be served by a local stand-in for chicagoelections.com, so scrapes
+can be benchmarked & tested with no network.
+
+Usage:
+    python -m openelex.us.il.places.chicago.replay record ARCHIVE
+    python -m openelex.us.il.places.chicago.replay serve ARCHIVE [--port 8000]
+    python -m openelex.us.il.places.chicago.replay run ARCHIVE [--pipeline] [--output DIR]
+
+record scrapes chicagoelections.com into election_json/ while recording;
+serve runs the stand-in site; run scrapes the stand-in site from scratch,
+in a temporary directory with no http or parse cache & no checkpoints from
+earlier runs, & copies the election files into --output if it's given, &
+scrape_metrics.json into --output or the working directory.
+"""
+import os
+import gzip
+import json
+import zlib
+import base64
+import shutil
+import urlparse
+import argparse
+import tempfile
+import threading
+import BaseHTTPServer
+import SocketServer
+
+# left out when serving, since the body is served decoded & in one piece
+HOP_HEADERS = set(['content-encoding', 'transfer-encoding', 'content-length', 'connection', 'keep-alive'])
+
+class Recorder(object):
+
+    def __init__(self, filename):
+        self._lock = threading.Lock()
+        self._seen = set()
+        self._file = gzip.open(filename, 'ab')
+
+    def record(self, method, url, data, context, response):
+        form = sorted(data.items()) if data else []
+        key = (method.upper(), url, tuple(form), context)
+
+        entry = {
+            'method': method.upper(),
+            'url': url,
+            'form': form,
+            'context': context,
+            'status': response.status_code,
+            'final_url': response.url,
+            'headers': dict((k.lower(), v) for k, v in response.headers.items()),
+            'encoding': response.encoding,
+            'content': base64.b64encode(response.content),
+        }
+
+        with self._lock:
+            if key in self._seen:
+                return
+            self._seen.add(key)
+            self._file.write(json.dumps(entry)+'\n')
+            # readable up to here even if the run dies
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_archive(filename):
+    """
+    Yields the entries in an archive, stopping quietly at the end of one
+    cut short by a crash
+    """
+    with gzip.open(filename, 'rb') as f:
+        try:
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                yield json.loads(line)
+        except (IOError, EOFError, zlib.error):
+            return
+
+
+class ReplayServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves the responses in an archive. Like the real site, it remembers the
+    last election POSTed & uses it to pick which contest menu to serve.
+    """
+    daemon_threads = True
+
+    def __init__(self, filename, address=('127.0.0.1', 0)):
+        self.responses = {}
+        for entry in read_archive(filename):
+            path = self._path(entry['url'])
+            form = tuple(tuple(pair) for pair in entry['form'])
+            self.responses[(entry['method'], path, form, entry['context'])] = entry
+        self.election = None
+        self._handlers = []
+
+        BaseHTTPServer.HTTPServer.__init__(self, address, _ReplayHandler)
+
+    @property
+    def base_url(self):
+        return 'http://%s:%s/' % self.server_address
+
+    def lookup(self, method, path, form):
+        form = tuple(sorted(form))
+        if method == 'POST' and 'flag1' in dict(form):
+            self.election = dict(form).get('D3')
+
+        return (self.responses.get((method, path, form, self.election)) or
+                self.responses.get((method, path, form, None)))
+
+    def serve_in_background(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def process_request(self, request, client_address):
+        # as ThreadingMixIn does, but keeping the thread to wait for
+        thread = threading.Thread(target=self.process_request_thread, args=(request, client_address))
+        thread.daemon = True
+        thread.start()
+        self._handlers = [handler for handler in self._handlers if handler.is_alive()] + [thread]
+
+    def shutdown(self, timeout=5):
+        """
+        Stops serving & waits for the connections being handled to close,
+        so they aren't torn down as the interpreter exits
+        """
+        BaseHTTPServer.HTTPServer.shutdown(self)
+        for handler in self._handlers:
+            handler.join(timeout)
+        self.server_close()
+
+    def _path(self, url):
+        parts = urlparse.urlsplit(url)
+        return parts.path + ('?'+parts.query if parts.query else '')
+
+
+class _ReplayHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._replay('GET', [])
+
+    def do_POST(self):
+        length = int(self.headers.get('content-length', 0))
+        form = urlparse.parse_qsl(self.rfile.read(length), keep_blank_values=True)
+        form = [(k.decode('utf-8'), v.decode('utf-8')) for k, v in form]
+        self._replay('POST', form)
+
+    def _replay(self, method, form):
+        entry = self.server.lookup(method, self.path, form)
+        if entry is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        content = base64.b64decode(entry['content'])
+        self.send_response(entry['status'])
+        for header, value in entry['headers'].items():
+            if header not in HOP_HEADERS:
+                self.send_header(header, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def scrape(scraper, pipeline=False):
+    if not os.path.exists('election_json'):
+        os.makedirs('election_json')
+
+    if pipeline:
+        from openelex.us.il.places.chicago.pipeline import ScrapePipeline
+        ScrapePipeline(scraper).run()
+    else:
+        for elec_name, contests, registered_voters, ballots_cast in scraper.election_urls():
+            scraper.make_elections_json(elec_name, contests, registered_voters, ballots_cast)
+
+
+if __name__ == '__main__':
+    from openelex.us.il.places.chicago.scraper import Scraper
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', choices=['record', 'serve', 'run'])
+    parser.add_argument('archive')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--pipeline', action='store_true')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    if args.mode == 'record':
+        scraper = Scraper(record_to=args.archive)
+        try:
+            scrape(scraper, args.pipeline)
+        finally:
+            scraper.recorder.close()
+
+    elif args.mode == 'serve':
+        server = ReplayServer(args.archive, ('127.0.0.1', args.port))
+        print 'serving %s at %s' % (args.archive, server.base_url)
+        server.serve_forever()
+
+    elif args.mode == 'run':
+        server = ReplayServer(args.archive)
+        server.serve_in_background()
+
+        # election_json/, .cache & .checkpoints are all relative to the
+        # working directory, so one left by record would be picked up
+        cwd = os.getcwd()
+        work_dir = tempfile.mkdtemp()
+        output = os.path.join(cwd, args.output) if args.output else cwd
+        try:
+            os.chdir(work_dir)
+            scraper = Scraper(base_url=server.base_url, requests_per_minute=0, parse_cache_dir=None)
+            try:
+                scrape(scraper, args.pipeline)
+            finally:
+                # so the server's handler threads aren't left waiting on
+                # kept alive connections as the interpreter exits. not
+                # scraper.close(), which fails on scrapelib's ftp adapter
+                for prefix in ('http://', 'https://'):
+                    scraper.adapters[prefix].close()
+
+                # kept even if the scrape failed
+                if os.path.exists(scraper.metrics_file or ''):
+                    if not os.path.exists(output):
+                        os.makedirs(output)
+                    shutil.copy(scraper.metrics_file, output)
+
+            if args.output:
+                for filename in os.listdir('election_json'):
+                    shutil.copy(os.path.join('election_json', filename), output)
+        finally:
+            try:
+                server.shutdown()
+            finally:
+                os.chdir(cwd)
+                shutil.rmtree(work_dir)
@@ -3,19 +3,47 @@ import lxml.html
 import os
 import json
 import re
+import time
+import threading
+from multiprocessing.pool import ThreadPool
 from dateutil.parser import parse
-import requests
+
+from openelex.us.il.places.chicago.cache import HTTPCache, DEFAULT_TTL_POLICY, content_hash
+from openelex.us.il.places.chicago.checkpoint import Checkpoint
+from openelex.us.il.places.chicago.compact import CompactWriter
+from openelex.us.il.places.chicago.connections import PooledAdapter
+from openelex.us.il.places.chicago.metrics import ScrapeMetrics
+from openelex.us.il.places.chicago.parse import ward_json, ParseCache, BROKEN_PAGE
+from openelex.us.il.places.chicago.replay import Recorder
+from openelex.us.il.places.chicago.throttle import AdaptiveThrottle
+from openelex.us.il.places.chicago.writer import ElectionWriter
 
 class Scraper(scrapelib.Scraper):
     def __init__(   self,
                     raise_errors=True,
                     requests_per_minute=100,
+                    min_requests_per_minute=20,
+                    max_requests_per_minute=300,
+                    adaptive_throttle=True,
                     follow_robots=True,
                     retry_attempts=3,
                     retry_wait_seconds=2,
                     header_func=None,
                     url_pattern=None,
-                    string_on_page=None ):
+                    string_on_page=None,
+                    workers=1,
+                    cache_dir='.cache',
+                    cache_ttl_policy=DEFAULT_TTL_POLICY,
+                    cache_max_bytes=2*1024**3,
+                    parse_cache_dir='.parse_cache',
+                    compact_dir=None,
+                    pool_connections=10,
+                    pool_maxsize=None,
+                    keep_alive=True,
+                    timeout=60,
+                    metrics_file='scrape_metrics.json',
+                    base_url='http://www.chicagoelections.com/',
+                    record_to=None ):
 
         super(Scraper, self).__init__(  raise_errors=raise_errors,
                                         requests_per_minute=requests_per_minute,
@@ -23,75 +51,283 @@ class Scraper(scrapelib.Scraper):
                                         retry_wait_seconds=retry_wait_seconds,
                                         header_func=header_func )
 
-        self.base_url = 'http://www.chicagoelections.com/'
+        # point at a replay.ReplayServer to scrape a recorded archive
+        self.base_url = base_url
+
+        # all traffic, including the error pages fetch_ward_page keeps,
+        # goes through this session's pooled connections
+        self.timeout = timeout
+        if not keep_alive:
+            self.headers['Connection'] = 'close'
+        self.mount_pool(pool_connections, pool_maxsize or max(workers, 10))
+
+        # used in place of scrapelib's cache_storage, which never expires
+        # anything & can't cache the POSTed election/contest menus
+        self.http_cache = HTTPCache(cache_dir, cache_ttl_policy, cache_max_bytes)
+
+        # parsed ward tables, so unchanged pages aren't parsed again
+        self.parse_cache = ParseCache(parse_cache_dir) if parse_cache_dir else None
+
+        # if set, elections are also written here in the compact format
+        self.compact_dir = compact_dir
+
+        # number of ward pages fetched at once; 1 fetches serially
+        self.workers = workers
+        self._ward_pool = None
+        self._throttle_lock = threading.Lock()
+
+        # starts at requests_per_minute, then speeds up while the site is
+        # healthy & backs off when it errors, slows down or breaks pages
+        self.throttle = None
+        if requests_per_minute and adaptive_throttle:
+            self.throttle = AdaptiveThrottle(requests_per_minute, min_requests_per_minute, max_requests_per_minute)
 
-        cache_dir = '.cache'
-        self.cache_storage = scrapelib.FileCache(cache_dir)
+        self.metrics = ScrapeMetrics()
+        self.metrics_file = metrics_file
+        self._request_context = threading.local()
+
+        # if set, every request & response is appended to this archive
+        self.recorder = Recorder(record_to) if record_to else None
+
+    def _throttle(self):
+        if self.throttle:
+            self.throttle.wait()
+        else:
+            # scrapelib's throttle is not thread safe. serializing it means
+            # every worker draws from the same requests_per_minute budget
+            with self._throttle_lock:
+                super(Scraper, self)._throttle()
+        self._request_context.sent = time.time()
+
+    def request(self, method, url, **kwargs):
+        start = time.time()
+        self.adapter.reset_sends()
+        resp = None
+        cache_state = 'miss'
+        cache_context = kwargs.pop('cache_context', None)
+        refresh = kwargs.pop('refresh', False)
+        try:
+            key = self.http_cache.key_for_request(method, url, kwargs.get('params'), kwargs.get('data'), cache_context)
+
+            entry = None if refresh else self.http_cache.get(key)
+            if entry and entry.is_fresh(self.http_cache.ttl(url)):
+                cache_state = 'hit'
+                resp = entry.response()
+                return resp
+
+            headers = dict(kwargs.pop('headers', None) or {})
+            if entry:
+                headers.update(entry.validators())
+
+            try:
+                resp = super(Scraper, self).request(method, url, headers=headers, **kwargs)
+            except Exception as e:
+                if self.throttle:
+                    self.throttle.failure()
+                if isinstance(e, scrapelib.HTTPError):
+                    # error pages are recorded too, so a replay fails the same way
+                    self.record(method, url, kwargs.get('data'), cache_context, e.response)
+                raise
+
+            if self.throttle:
+                if self.adapter.sends() > 1 or BROKEN_PAGE in resp.content.lower():
+                    self.throttle.failure()
+                else:
+                    self.throttle.success(time.time() - self._request_context.sent)
+
+            if entry and (resp.status_code == 304 or
+                          (resp.status_code == 200 and content_hash(resp.content) == entry.meta['sha1'])):
+                self.http_cache.revalidated(key, entry, resp)
+                cache_state = 'revalidated'
+                resp = entry.response()
+                resp.revalidated = True
+            elif resp.status_code == 200:
+                self.http_cache.set(key, resp)
+
+            return resp
+        finally:
+            if resp is not None:
+                self.record(method, url, kwargs.get('data'), cache_context, resp)
+            self.metrics.record_request(self.url_class(method, url, kwargs.get('data')),
+                                        time.time() - start,
+                                        len(resp.content) if resp is not None else 0,
+                                        cache_state,
+                                        retries=max(self.adapter.sends() - 1, 0),
+                                        error=resp is None)
+
+    def record(self, method, url, data, cache_context, resp):
+        if self.recorder:
+            self.recorder.record(method, url, data, cache_context, resp)
+
+    def is_cached(self, method, url, data=None, cache_context=None):
+        key = self.http_cache.key_for_request(method, url, data=data, context=cache_context)
+        entry = self.http_cache.get(key)
+        return bool(entry and entry.is_fresh(self.http_cache.ttl(url)))
+
+    def url_class(self, method, url, data=None):
+        if 'election3.asp' in url:
+            if method.upper() == 'POST' and data and 'flag' in data:
+                return 'contest menu'
+            return 'election menu'
+        return 'ward page'
+
+    def write_metrics(self):
+        if self.metrics_file:
+            extra = {'connections': self.connection_stats()}
+            if self.throttle:
+                extra['throttle'] = self.throttle.summary()
+            self.metrics.write(self.metrics_file, **extra)
+
+    def mount_pool(self, pool_connections, pool_maxsize):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.adapter = PooledAdapter(pool_connections=pool_connections,
+                                     pool_maxsize=pool_maxsize)
+        self.mount('http://', self.adapter)
+        self.mount('https://', self.adapter)
+
+    def connection_stats(self):
+        return self.adapter.connection_stats()
+
+    def print_connection_stats(self):
+        stats = self.connection_stats()
+        print 'CONNECTIONS: %s requests over %s connections (%s reused)' % (stats['requests'], stats['connections'], stats['reused'])
+
+    def ward_pool(self):
+        if self._ward_pool is None:
+            self._ward_pool = ThreadPool(self.workers)
+        return self._ward_pool
     
     def election_urls(self):
+        for elec_name in self.election_names():
+            print 'ELECTION', elec_name
+
+            contests = []
+            registered_voters = None
+            ballots_cast = None
+            for contest_name, contest_urls in self.contest_urls(elec_name):
+                if 'REGISTERED VOTERS - TOTAL' in contest_name:
+                    registered_voters = contest_urls
+                elif 'BALLOTS CAST - ' in contest_name:
+                    ballots_cast = contest_urls
+                else:
+                    contests.append((contest_name, contest_urls))
+
+            yield elec_name, contests, registered_voters, ballots_cast
+
+    def election_names(self):
         start_url = self.base_url + 'en/election3.asp'
 
         r = self.get(start_url)
         tree = lxml.html.fromstring(r.text)
 
-        elec_options = tree.xpath("//table[@class='maincontent']//select/option/@value")
-        for elec_name in elec_options:
-            print 'ELECTION', elec_name
+        return tree.xpath("//table[@class='maincontent']//select/option/@value")
+
+    def contest_urls(self, elec_name):
+        """
+        Yields the name & ward result urls of each contest in an election,
+        as soon as that contest's menu has been POSTed
+        """
+        start_url = self.base_url + 'en/election3.asp'
+
+        elec_post_data = {
+            'D3' : elec_name,
+            'flag1' : '1',
+            'B1' : 'View'
+            }
+
+        result = self.request('POST', start_url, data=elec_post_data)
+        # the site keeps the selected election in its session, so if this
+        # menu came from the cache, the election has to be POSTed for real
+        # before asking the site for a contest menu
+        election_selected = not result.fromcache or getattr(result, 'revalidated', False)
+
+        tree = lxml.html.fromstring(result.text)
+        contest_options = tree.xpath("//table[@class='maincontent']//select/option/@value")
+        for contest_name in contest_options:
             post_data = {
-                'D3' : elec_name,
-                'flag1' : '1',
-                'B1' : 'View'
+                'D3' : contest_name,
+                'flag' : '1',
+                'B1' : '  View The Results   '
                 }
-            
-            contests = []
 
-            _, result = self.urlretrieve(start_url, method='POST', body=post_data)
-            tree = lxml.html.fromstring(result.text)
-            contest_options = tree.xpath("//table[@class='maincontent']//select/option/@value")
-            for contest_name in contest_options:
-                post_data = {
-                    'D3' : contest_name,
-                    'flag' : '1',
-                    'B1' : '  View The Results   '
-                    }
+            contest_urls = None
+            try:
+                if not election_selected and not self.is_cached('POST', result.url, post_data, elec_name):
+                    self.request('POST', start_url, data=elec_post_data, refresh=True)
+                    election_selected = True
 
-                try:
-                    _, result = self.urlretrieve(result.url, method='POST', body=post_data)
-                    contest_urls = []
-                    ballots_cast = None
-                    registered_voters = None
-
-                    try:
-                        tree = lxml.html.fromstring(result.text)
-                        links = tree.xpath("//table//tr//td[1]//a")
-                        if 'REGISTERED VOTERS - TOTAL' in contest_name:
-                            registered_voters = [(link.text, self.base_url+'en/'+link.attrib['href']) for link in links]
-                        elif 'BALLOTS CAST - ' in contest_name:
-                            ballots_cast = [(link.text, self.base_url+'en/'+link.attrib['href']) for link in links]
-                        else:
-                            for link in links:
-                                contest_urls.append((link.text, self.base_url+'en/'+link.attrib['href']))
-                            contests.append((contest_name, contest_urls))
-                    except:
-                        # TO DO - figure out what's going on here
-                        print "*** ERROR: UNABLE TO PARSE HTML ***"
-                        print "SKIPPING CONTEST: %s" % contest_name
-                        print "request url: %s" % result.url
-                        print "request post data: %s" %post_data
-                        print "***********************************\n"
+                result = self.request('POST', result.url, data=post_data, cache_context=elec_name)
 
+                try:
+                    tree = lxml.html.fromstring(result.text)
+                    links = tree.xpath("//table//tr//td[1]//a")
+                    contest_urls = [(link.text, self.base_url+'en/'+link.attrib['href']) for link in links]
                 except:
-                    print "*** ERROR: UNABLE TO RETRIEVE RESULT ***"
+                    # TO DO - figure out what's going on here
+                    print "*** ERROR: UNABLE TO PARSE HTML ***"
                     print "SKIPPING CONTEST: %s" % contest_name
                     print "request url: %s" % result.url
                     print "request post data: %s" %post_data
                     print "***********************************\n"
 
-            yield elec_name, contests, registered_voters, ballots_cast
+            except:
+                print "*** ERROR: UNABLE TO RETRIEVE RESULT ***"
+                print "SKIPPING CONTEST: %s" % contest_name
+                print "request url: %s" % result.url
+                print "request post data: %s" %post_data
+                print "***********************************\n"
+
+            if contest_urls is not None:
+                yield contest_name, contest_urls
 
     def make_elections_json(self, elec_name, contests, registered_voters, ballots_cast):
-        # slug = re.sub(r'[^0-9a-z]+', '_', elec_name.lower().strip())
         elec_name = elec_name[5:]
+        slug = self.election_slug(elec_name)
+
+        filename = self.election_filename(slug)
+
+        if not os.path.exists(filename):
+
+            # contests finished by an earlier, interrupted run are
+            # picked up from the checkpoint instead of being scraped again
+            checkpoint = Checkpoint(slug)
+            writers = self.election_writers(slug, elec_name)
+
+            resumed = 0
+            for contest_json in checkpoint.resume([contest_name for contest_name, _ in contests]):
+                for writer in writers:
+                    writer.write_contest(contest_json)
+                resumed += 1
+            if resumed:
+                print '  RESUMING AFTER %s CONTESTS' % resumed
+
+            for contest_name, contest_urls in contests[resumed:]:
+                contest_json = self.make_contest_json(contest_name, contest_urls)
+                checkpoint.record(contest_name, contest_json)
+                for writer in writers:
+                    writer.write_contest(contest_json)
+
+            for writer in writers:
+                writer.close()
+            checkpoint.clear()
+
+            self.print_connection_stats()
+            self.write_metrics()
+
+    def election_filename(self, slug):
+        return 'election_json/'+slug+'.json'
+
+    def election_writers(self, slug, elec_name):
+        writers = [ElectionWriter(self.election_filename(slug), elec_name)]
+        if self.compact_dir:
+            if not os.path.exists(self.compact_dir):
+                os.makedirs(self.compact_dir)
+            writers.append(CompactWriter(os.path.join(self.compact_dir, slug+'.oec'), elec_name))
+        return writers
+
+    def election_slug(self, elec_name):
+        # slug = re.sub(r'[^0-9a-z]+', '_', elec_name.lower().strip())
         parts = elec_name.split(' - ')
 
         if 'special' in parts[0].lower():
@@ -123,20 +359,7 @@ class Scraper(scrapelib.Scraper):
 
         slug = '__'.join(slug_parts)
 
-        filename = 'election_json/'+slug+'.json'
-
-        if not os.path.exists(filename):
-
-            election_json = {
-                'election_name': elec_name,
-                'date': None,
-                'contests': [self.make_contest_json(contest_name, contest_urls) for contest_name, contest_urls in contests]
-            }
-
-            with open(filename, 'w+') as outfile:
-                json.dump(election_json, outfile, indent=4)
-
-
+        return slug
 
     def make_summary_json(self, summary_urls):
         return {}
@@ -149,102 +372,40 @@ class Scraper(scrapelib.Scraper):
             'position': contest_name,
             'results': []
         }
-        for ward, url in contest_urls:
 
-            try:
-                _, result = self.urlretrieve(url)
-            except:
-                print "-"*60
-                print "NOTE: using requests instead of urlretrieve b/c urlretrieve failed"
-                print "ward results url: %s" % url
-                print "contest: %s" % contest_name
-                print "-"*60
-                result = requests.get(url)
-
-            if 'ward, election selected or contest was bad' in result.text.lower():
-                print "*"*60
-                print "ERROR: BROKEN RESULTS PAGE"
-                print "url: %s" % url
-                print "*"*60
-            else:
-
-                tree = lxml.html.fromstring(result.text)
-
-                header_td_list = tree.xpath("//table[1]//tr[2]//td")
-                tbl_header = [td.xpath("string(.)") for td in header_td_list]
-                num_cols = len(tbl_header)
-
-                # finding the position of the last row of results (the row w/ totals)
-                # b/c sometimes there are extra non-result rows in the table
-                rows = tree.xpath("//table[1]//tr")
-                first_col_str = [tr.xpath("td")[0].xpath("string(.)") if tr.xpath("td") else None for tr in rows]
-                if 'Total' in first_col_str:
-                    idx_total_row = list(reversed(first_col_str)).index('Total')
-                    precinct_td_list = tree.xpath("//table[1]//tr[position() > 2 and not(position() > last()-%s)]//td" % (idx_total_row+1))
-                    precinct_data = [precinct_td_list[i:i+num_cols] for i in range(0, len(precinct_td_list), num_cols)]
-                else:
-                    precinct_td_list = tree.xpath("//table[1]//tr[position() > 2]//td")
-                    precinct_data = [precinct_td_list[i:i+num_cols] for i in range(0, len(precinct_td_list), num_cols)]
-
-                if precinct_data:
-                    totals = []
-                    # loop through columns
-                    for i in range(0, len(precinct_data[0])):
-                        col_total = 0
-                        # loop through rows to get the sum of all values in a column
-                        for row in precinct_data:
-                            try:
-                                parsed_num = int(row[i].xpath("string(.)"))
-                                col_total += parsed_num
-                            except:
-                                # sometimes these will be percentages but these will be ignored later anyways
-                                col_total = None
-                        totals.append(col_total)
-
-                    # TO-DO: distinguish between voting on candidates vs voting on Y/N vote?
-                    if len(tbl_header) > 2: # more than one candidate running
-                        candidates = tbl_header[2::2]
-                        votes_totals = totals[2::2]
-                    else: # only one candidate
-                        candidates = [tbl_header[1]]
-                        votes_totals = [totals[1]]
-
-                    results_by_precinct = []
-                    for row in precinct_data:
-                        row_string = [td.xpath("string(.)") for td in row]
-                        precinct = row_string[0]
-                        
-                        precinct_result = {
-                            'precinct': precinct,
-                            'candidate_totals': {}
-                        }
-                        if num_cols > 2:
-                            votes_precinct = row_string[2::2]
-                        else: # only one candidate
-                            votes_precinct = [row_string[1]]
-
-                        for candidate, vote in zip(candidates, votes_precinct):
-                            precinct_result['candidate_totals'][candidate] = int(vote)
-
-                        results_by_precinct.append(precinct_result)
-
-                    candidate_totals = {}
-                    for candidate, votes_total in zip(candidates, votes_totals):
-                        candidate_totals[candidate] = int(votes_total)
-
-                    ward_result = {
-                        'ward': ward,
-                        'candidate_totals': candidate_totals,
-                        'results_by_precinct': results_by_precinct
-                    }
-
-                    contest_json['results'].append(ward_result)
-                else:
-                    print "*"*60
-                    print "ERROR: MISSING PRECINCT LEVEL DATA"
-                    print "contest: %s" % contest_name
-                    print "ward: %s" % ward
-                    print "*"*60
-
-        return contest_json 
-        
\ No newline at end of file
+        fetch = lambda ward_url: self.fetch_ward_page(contest_name, *ward_url)
+        if self.workers > 1:
+            # pages are fetched in parallel, but map keeps them in ward order
+            # so the output is the same as a serial run
+            pages = self.ward_pool().map(fetch, contest_urls)
+        else:
+            pages = map(fetch, contest_urls)
+
+        start = time.time()
+        for (ward, url), page in zip(contest_urls, pages):
+            ward_result = self.make_ward_json(contest_name, ward, url, page)
+            if ward_result:
+                contest_json['results'].append(ward_result)
+        self.metrics.record_parse(contest_name, time.time() - start, len(contest_urls))
+
+        return contest_json
+
+    def fetch_ward_page(self, contest_name, ward, url):
+
+        # not urlretrieve, which leaves a temp file behind for every page
+        try:
+            result = self.get(url)
+        except scrapelib.HTTPError as e:
+            # retried already; the error page is kept, as it always was
+            print "-"*60
+            print "NOTE: keeping the error page b/c the GET failed"
+            print "ward results url: %s" % url
+            print "contest: %s" % contest_name
+            print "-"*60
+            self.metrics.record_fallback('ward page')
+            result = e.response
+
+        return result.text
+
+    def make_ward_json(self, contest_name, ward, url, page):
+        return ward_json(contest_name, ward, url, page, self.parse_cache)
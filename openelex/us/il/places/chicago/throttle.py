@@ -0,0 +1,79 @@
+import time
+import threading
+
+class AdaptiveThrottle(object):
+    """
+    Spaces out requests at a rate that adapts to how the site is holding up.
+
+    Each healthy response raises the rate by a fixed step; an error, a slow
+    response or a broken results page cuts it by a factor (additive
+    increase, multiplicative decrease). The rate stays between min_rate &
+    max_rate requests per minute.
+    """
+
+    def __init__(self, rate, min_rate, max_rate, slow_seconds=5.0, increase=2.0, decrease=0.5):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.slow_seconds = slow_seconds
+        self.increase = increase
+        self.decrease = decrease
+
+        self._lock = threading.Lock()
+        self._next_request = 0
+        self._last_backoff = 0
+
+        self.requests = 0
+        self.backoffs = 0
+        self.lowest_rate = self.highest_rate = self.rate
+        self._rate_sum = 0.0
+
+    def wait(self):
+        """
+        Blocks until this thread's turn to make a request
+        """
+        with self._lock:
+            now = time.time()
+            # slots are handed out in turn, so threads sleep concurrently
+            start = max(now, self._next_request)
+            self._next_request = start + 60.0 / self.rate
+
+            self.requests += 1
+            self._rate_sum += self.rate
+
+        if start > now:
+            time.sleep(start - now)
+
+    def success(self, seconds):
+        if seconds > self.slow_seconds:
+            self.failure()
+            return
+        with self._lock:
+            self._set_rate(self.rate + self.increase)
+
+    def failure(self):
+        with self._lock:
+            now = time.time()
+            # the requests already in flight when the site started
+            # struggling only count as one backoff
+            if now - self._last_backoff < 60.0 / self.rate:
+                return
+            self._last_backoff = now
+            self.backoffs += 1
+            self._set_rate(self.rate * self.decrease)
+
+    def _set_rate(self, rate):
+        self.rate = min(max(rate, self.min_rate), self.max_rate)
+        self.lowest_rate = min(self.lowest_rate, self.rate)
+        self.highest_rate = max(self.highest_rate, self.rate)
+
+    def summary(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'backoffs': self.backoffs,
+                'final_requests_per_minute': self.rate,
+                'lowest_requests_per_minute': self.lowest_rate,
+                'highest_requests_per_minute': self.highest_rate,
+                'mean_requests_per_minute': self._rate_sum / self.requests if self.requests else self.rate,
+            }
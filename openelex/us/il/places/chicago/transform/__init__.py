@@ -1,9 +1,9 @@
 from datetime import datetime
 import re
-import probablepeople as pp
 
 from openelex.base.transform import Transform, registry
 from openelex.models import Candidate, Contest, Office, Party, RawResult, Result, Retention, BallotMeasure
+from openelex.us.il.places.chicago.namecache import NAME_CACHE
 
 STATE = 'IL'
 PLACE = 'Chicago'
@@ -24,6 +24,195 @@ candidate_fields = meta_fields + ['full_name', 'given_name',
 result_fields = meta_fields + ['reporting_level', 'jurisdiction',
                                'votes', 'total_votes', 'vote_breakdowns']
 
+# (regex, office name) for each office, searched for in the raw office string.
+# the order of searches matters (b/c of overlapping keywords)
+OFFICE_SEARCHES = [
+    # national
+    ('president.+united\sstates|pres\sand\svice\spres|pres.+u.?s.?', 'President'),
+    ('senator.+u\.s\.|u\.s\..+senator|united\sstates\ssenator', 'U.S. Senate'),
+    ('u\.s\.\srepresentative|rep.+in\scongress', 'U.S. House'),
+
+    # state
+    ('state\ssenator', 'State Senate'),
+    ('state\srepresentative|rep.+gen.+assembly', 'State House'),
+    ('governor.+lieutenant\sgovernor', 'Governor & Lieutenant Governor'),
+    ('lieutenant\sgovernor', 'Lieutenant Governor'),
+    ('governor', 'Governor'),
+    ('secretary', 'Secretary of State'),
+    ('attorney\sgeneral', 'Attorney General'),
+    ('state.+attorney', 'State\'s Attorney'),
+    ('comptroller', 'Comptroller'),
+    ('county.+treasurer|treasurer.+county', 'County Treasurer'),  # should 'County' be in the office name?
+    ('treasurer', 'Treasurer'),
+
+    # county
+    ('board.+pres.+county|county.+board.+pres|pres.+county.+board', 'County Board President'),  # should 'County' be in the office name?
+    ('county.+comm|comm.+county', 'County Commissioner'),
+    ('sheriff', 'County Sheriff'),
+    ('assessor', 'County Assessor'),
+    ('deeds', 'County Recorder of Deeds'),
+    ('circuit.+clerk|clerk.+circuit', 'County Circuit Court Clerk'),
+    ('clerk', 'County Clerk'),
+
+    # courts
+    ('supreme\scourt', 'Supreme Court Judge'),
+    ('app?ellate\scourt', 'Appellate Court Judge'),
+    ('judge.+circuit.+\d|judge.+\d.+sub|circuit.+court.+\d.+sub|judge.+subcircuit', 'Circuit Court Judge'),
+    ('circuit.+judge|judge.+circuit', 'Circuit Court Judge'),
+
+    # city
+    ('mayor', 'Mayor'),
+    ('alderman', 'Alderman'),
+    ('committeeman', 'Ward Committeeman'),
+]
+
+# all of OFFICE_SEARCHES as one regex: an empty group after each search's
+# lookahead, tried in order, so the first search that matches anywhere in
+# the office wins, just as searching for each in turn would
+_office_matcher = re.compile('|'.join(r'(?=[\s\S]*?(?:%s))()' % srch_regex for srch_regex, _ in OFFICE_SEARCHES))
+_office_names = {}
+
+def clean_office_name(office):
+    """
+    The standard name of the office in a raw office string, or None.
+    Remembered for each raw office string, since a few thousand of them
+    cover every result.
+    """
+    try:
+        return _office_names[office]
+    except KeyError:
+        match = _office_matcher.match(office)
+        name = OFFICE_SEARCHES[match.lastindex - 1][1] if match else None
+        _office_names[office] = name
+        return name
+
+
+class ContestIndex(object):
+    """
+    Which contest each (election_id, contest_slug) is for.
+
+    The contests of an election are loaded with one query the first time
+    the election comes up, & each contest slug is then matched against them
+    in memory, once. Contests created along the way are added as they are,
+    so no transform queries for contests row by row. Slugs with no contest
+    aren't remembered, so one created later by other means is still found.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._elections = {}
+        self._contests = {}
+
+    def get(self, key):
+        """
+        The contest for a key already found; KeyError otherwise
+        """
+        return self._contests[key]
+
+    def find(self, key, fields):
+        """
+        The first of the election's contests with these field values, as
+        Contest.objects.filter(**fields)[0] would find it
+        """
+        for contest in self._election_contests(fields['election_id']):
+            if _matches(contest, fields):
+                break
+        else:
+            return None
+
+        self._contests[key] = contest
+        return contest
+
+    def add(self, key, contest):
+        if contest.election_id in self._elections:
+            self._elections[contest.election_id].append(contest)
+        self._contests[key] = contest
+
+    def _election_contests(self, election_id):
+        try:
+            return self._elections[election_id]
+        except KeyError:
+            contests = list(Contest.objects(election_id=election_id).no_dereference())
+            self._elections[election_id] = contests
+            return contests
+
+# shared by the transforms, so the ones that run after CreateContestsTransform
+# see the contests it created
+CONTEST_INDEX = ContestIndex()
+
+
+class BallotChoiceIndex(object):
+    """
+    Which Candidate, Retention or BallotMeasure each (election_id,
+    contest_slug, choice) is for.
+
+    The choices of the elections being transformed are loaded up front, one
+    query in all, & each key is matched against its contest's choices in
+    memory, once. Where more than one choice matches, duplicates='first'
+    takes the first, as it was loaded, & duplicates='error' raises the
+    model's MultipleObjectsReturned.
+    """
+
+    def __init__(self, model, duplicates='first'):
+        if duplicates not in ('first', 'error'):
+            raise ValueError("duplicates must be 'first' or 'error', not %r" % duplicates)
+        self.model = model
+        self.duplicates = duplicates
+        # election_id -> contest id -> choices
+        self._elections = {}
+        self._choices = {}
+
+    def prefetch(self, election_ids):
+        election_ids = [election_id for election_id in election_ids
+                        if election_id not in self._elections]
+        if not election_ids:
+            return
+
+        for election_id in election_ids:
+            self._elections[election_id] = {}
+        for choice in self.model.objects(election_id__in=election_ids).no_dereference():
+            by_contest = self._elections[choice.election_id]
+            by_contest.setdefault(choice.contest.id, []).append(choice)
+
+    def get(self, key):
+        """
+        The choice for a key already seen; KeyError otherwise
+        """
+        return self._choices[key]
+
+    def find(self, key, fields):
+        """
+        The choice with these field values, as model.objects.get(**fields)
+        would find it, but for duplicates
+        """
+        self.prefetch([fields['election_id']])
+        contests = self._elections[fields['election_id']]
+        choices = [choice for choice in contests.get(fields['contest'].id, [])
+                   if _matches(choice, fields)]
+
+        if not choices:
+            raise self.model.DoesNotExist('no %s matching %s' % (self.model.__name__, fields))
+        if len(choices) > 1 and self.duplicates == 'error':
+            raise self.model.MultipleObjectsReturned('%d %ss matching %s' % (
+                len(choices), self.model.__name__, fields))
+
+        self._choices[key] = choices[0]
+        return choices[0]
+
+
+def _matches(document, fields):
+    # references aren't dereferenced, so are compared by id
+    for name, value in fields.items():
+        found = getattr(document, name, None)
+        if hasattr(value, 'id'):
+            found, value = getattr(found, 'id', found), value.id
+        if found != value:
+            return False
+    return True
+
+
 class BaseTransform(Transform):
 
     # these are offices where we have to parse district
@@ -39,7 +228,7 @@ class BaseTransform(Transform):
     def __init__(self):
         super(BaseTransform, self).__init__()
         self._office_cache = {}
-        self._contest_cache = {}
+        self._contest_index = CONTEST_INDEX
 
     def get_raw_results(self):
         return RawResult.objects.filter(state=STATE, place=PLACE).no_cache()
@@ -52,35 +241,44 @@ class BaseTransform(Transform):
             fields['full_name'] = None
             return fields
 
-        try:
-            name_parts, name_type = pp.tag(full_name)
-
-            if name_type != 'Person':
-                print "***************************"
-                print "NOT A PERSON:", fields['full_name']
-                print "fields:", fields
-                print "tagged name:", name_parts
-                print "***************************"
-                fields['full_name'] = full_name
-                return fields
-
-            fields['given_name'] = name_parts.get('GivenName')
-            fields['family_name'] = name_parts.get('Surname')
-            if 'SuffixGenerational' in name_parts:
-                fields['suffix'] = name_parts['SuffixGenerational']
-            if 'Nickname' in name_parts:
-                fields['additional_name'] = name_parts['Nickname']
-
+        tagged = NAME_CACHE.tag(full_name)
+        if tagged is None:
+            print "***************************"
+            print "UNABLE TO TAG:", full_name
+            print "***************************"
             fields['full_name'] = full_name
+            return fields
 
-        except pp.RepeatedLabelError:
+        name_parts, name_type = tagged
+        if name_type != 'Person':
             print "***************************"
-            print "UNABLE TO TAG:", full_name
+            print "NOT A PERSON:", fields['full_name']
+            print "fields:", fields
+            print "tagged name:", name_parts
             print "***************************"
             fields['full_name'] = full_name
+            return fields
+
+        fields['given_name'] = name_parts.get('GivenName')
+        fields['family_name'] = name_parts.get('Surname')
+        if 'SuffixGenerational' in name_parts:
+            fields['suffix'] = name_parts['SuffixGenerational']
+        if 'Nickname' in name_parts:
+            fields['additional_name'] = name_parts['Nickname']
+
+        fields['full_name'] = full_name
 
         return fields
 
+    def prewarm_names(self):
+        """
+        Tags every candidate name not already in the name cache, in parallel,
+        ahead of get_candidate_fields
+        """
+        names = set(full_name.strip() for full_name in self.get_raw_results().distinct('full_name'))
+        NAME_CACHE.prewarm(name for name in names
+                           if name.lower() not in ['no candidate', 'candidate withdrew'])
+
     def standardize_value(self, raw_val):
         if 'yes' in raw_val.lower():
             return 'yes'
@@ -113,39 +311,26 @@ class BaseTransform(Transform):
         """
         Returns the Contest model instance for a given RawResult.
 
-        Caches the result in memory to reduce the number of calls to the
-        datastore.
+        Looked up in the contest index, so the datastore is only queried
+        once per election.
         """
-        key = "%s-%s" % (raw_result.election_id, raw_result.contest_slug)
+        key = (raw_result.election_id, raw_result.contest_slug)
 
         try:
-            return self._contest_cache[key]
+            return self._contest_index.get(key)
         except KeyError:
             fields = self.get_contest_fields(raw_result)
 
             if fields:
                 fields.pop('source')
-                try:
-                    try:
-                        contest = Contest.objects.filter(**fields)[0]
-                    except IndexError:
-                        try:
-                            contest = Contest.objects.get(**fields)
-                        # temporary
-                        except Contest.DoesNotExist:
-                            print "##########"
-                            print "CONTEST DOES NOT EXIST"
-                            print fields
-                            print "##########"
-                            return None
-                except Exception:
+                contest = self._contest_index.find(key, fields)
+                if contest is None:
+                    print "##########"
+                    print "CONTEST DOES NOT EXIST"
                     print fields
-                    print "\n"
-                    raise
-                # self._contest_cache[key] = contest
+                    print "##########"
                 return contest
             else:
-                # self._contest_cache[key] = None
                 return None
 
     def get_contest_fields(self, raw_result):
@@ -192,82 +377,7 @@ class BaseTransform(Transform):
         See: https://github.com/openelections/core/blob/dev/openelex/us/wa/load.py#L370
 
         """
-
-        us_pres =       ('president.+united\sstates|pres\sand\svice\spres|pres.+u.?s.?', 
-                        'President')
-        us_senator =    ('senator.+u\.s\.|u\.s\..+senator|united\sstates\ssenator',
-                        'U.S. Senate')
-        us_rep =        ('u\.s\.\srepresentative|rep.+in\scongress',
-                        'U.S. House')
-
-        state_senator = ('state\ssenator',
-                        'State Senate')
-        state_rep =     ('state\srepresentative|rep.+gen.+assembly',
-                        'State House')
-        gov_lt_gov =    ('governor.+lieutenant\sgovernor',
-                        'Governor & Lieutenant Governor')
-        lt_gov =        ('lieutenant\sgovernor',
-                        'Lieutenant Governor')
-        gov =           ('governor',
-                        'Governor')
-        sec_state =     ('secretary',
-                        'Secretary of State')
-        aty_gen =       ('attorney\sgeneral',
-                        'Attorney General')
-        state_aty =     ('state.+attorney',
-                        'State\'s Attorney')
-        comptroller =   ('comptroller',
-                        'Comptroller')
-        county_treas =  ('county.+treasurer|treasurer.+county',
-                        'County Treasurer') # should 'County' be in the office name?
-        state_treas =   ('treasurer',
-                        'Treasurer')
-
-        # should 'County' be in the office name?
-        county_board_pres = ('board.+pres.+county|county.+board.+pres|pres.+county.+board',
-                        'County Board President')
-        county_board_comm = ('county.+comm|comm.+county',
-                        'County Commissioner')
-        sheriff =       ('sheriff',
-                        'County Sheriff')
-        assessor =      ('assessor',
-                        'County Assessor')
-        rec_deeds =     ('deeds',
-                        'County Recorder of Deeds')
-        cir_ct_clerk =  ('circuit.+clerk|clerk.+circuit',
-                        'County Circuit Court Clerk')
-        clerk =         ('clerk',
-                        'County Clerk')
-
-        supreme_ct =    ('supreme\scourt',
-                        'Supreme Court Judge')
-        appellate_ct =  ('app?ellate\scourt',
-                        'Appellate Court Judge')
-        subcircuit_ct = ('judge.+circuit.+\d|judge.+\d.+sub|circuit.+court.+\d.+sub|judge.+subcircuit',
-                        'Circuit Court Judge')
-        circuit_ct_full = ('circuit.+judge|judge.+circuit',
-                        'Circuit Court Judge')
-
-        mayor =         ('mayor',
-                        'Mayor')
-        alderman =      ('alderman',
-                        'Alderman')
-        committeeman =  ('committeeman',
-                        'Ward Committeeman')
-
-        # the order of searches matters (b/c of overlapping keywords)
-        office_searches = [us_pres, us_senator, us_rep, state_senator, state_rep,
-                          gov_lt_gov, lt_gov, gov, sec_state, aty_gen, state_aty, comptroller,
-                          county_treas, state_treas, county_board_pres, county_board_comm,
-                          sheriff, assessor, rec_deeds, cir_ct_clerk, clerk,
-                          supreme_ct, appellate_ct, subcircuit_ct, circuit_ct_full,
-                          mayor, alderman, committeeman]
-
-        for srch_regex, clean_office_name in office_searches:
-            if re.search(srch_regex, office):
-                return clean_office_name
-
-        return None
+        return clean_office_name(office)
 
     def _make_office_query(self, office_name, raw_result):
         """
@@ -326,10 +436,14 @@ class CreateContestsTransform(BaseTransform):
                     fields['created'] = datetime.now()
                     contest = Contest(**fields)
                     print "   %s" %contest
-                    contests.append(contest)
+                    contests.append((key, contest))
                     seen.add(key)
 
-        Contest.objects.insert(contests, load_bulk=False)
+        if contests:
+            ids = Contest.objects.insert([contest for key, contest in contests], load_bulk=False)
+            for (key, contest), contest_id in zip(contests, ids):
+                contest.id = contest_id
+                self._contest_index.add(key, contest)
 
     def _contest_key(self, raw_result):
         slug = raw_result.contest_slug
@@ -343,6 +457,7 @@ class CreateContestsTransform(BaseTransform):
         old = Contest.objects.filter(state=STATE)
         print "\tDeleting %d previously created contests" % old.count()
         old.delete()
+        self._contest_index.clear()
 
 
 class CreateBallotChoicesTransform(BaseTransform):
@@ -352,6 +467,8 @@ class CreateBallotChoicesTransform(BaseTransform):
         super(CreateBallotChoicesTransform, self).__init__()
 
     def __call__(self):
+        self.prewarm_names()
+
         candidates = []
         retentions = []
         ballot_measures = []
@@ -410,6 +527,7 @@ class CreateBallotChoicesTransform(BaseTransform):
         Candidate.objects.insert(candidates, load_bulk=False)
         Retention.objects.insert(retentions, load_bulk=False)
         BallotMeasure.objects.insert(ballot_measures, load_bulk=False)
+        NAME_CACHE.flush()
 
     def reverse(self):
         old = Candidate.objects.filter(state=STATE)
@@ -422,11 +540,23 @@ class CreateResultsTransform(BaseTransform):
 
     auto_reverse = True
 
+    # what to do where more than one ballot choice matches a RawResult;
+    # see BallotChoiceIndex
+    duplicate_choices = 'first'
+
     def __init__(self):
         super(CreateResultsTransform, self).__init__()
-        self._candidate_cache = {}
+        self._candidates = BallotChoiceIndex(Candidate, self.duplicate_choices)
+        self._retentions = BallotChoiceIndex(Retention, self.duplicate_choices)
+        self._ballot_measures = BallotChoiceIndex(BallotMeasure, self.duplicate_choices)
 
     def __call__(self):
+        self.prewarm_names()
+
+        election_ids = self.get_rawresults().distinct('election_id')
+        for index in (self._candidates, self._retentions, self._ballot_measures):
+            index.prefetch(election_ids)
+
         results = []
 
         # for now, skip offices that don't have candidates populated
@@ -440,28 +570,29 @@ class CreateResultsTransform(BaseTransform):
 
             if fields['contest']:
 
-                # if this is a judge retention
-                if rr.is_retention:
-                    value = rr.full_name
-                    fields['retention'] = self.get_retention(rr, extra={
-                            'contest': fields['contest'],
-                            'value': value,
-                        })
-                    fields['contest'] = fields['candidate'].contest
-                # if this is a ballot measure
-                elif rr.is_ballot_measure:
-                # if this is voting to fill an office
-                else:
-                    try:
+                try:
+                    # if this is a judge retention
+                    if rr.is_retention:
+                        fields['retention'] = self.get_retention(rr, extra={
+                                'contest': fields['contest'],
+                            })
+                    # if this is a ballot measure
+                    elif rr.is_ballot_measure:
+                        fields['ballot_measure'] = self.get_ballot_measure(rr, extra={
+                                'contest': fields['contest'],
+                            })
+                    # if this is voting to fill an office
+                    else:
                         fields['candidate'] = self.get_candidate(rr, extra={
                             'contest': fields['contest'],
                         })
-                        fields['contest'] = fields['candidate'].contest 
-                    # temporary
-                    except Candidate.MultipleObjectsReturned:
-                        print "*"*50
-                        print "multiple candidates returned"
-                        print "fields: %s" %fields
+                # only with duplicate_choices = 'error'
+                except (Candidate.MultipleObjectsReturned,
+                        Retention.MultipleObjectsReturned,
+                        BallotMeasure.MultipleObjectsReturned) as e:
+                    print "*"*50
+                    print e
+                    print "fields: %s" %fields
 
                 fields['raw_result'] = rr
                 result = Result(**fields)
@@ -474,6 +605,7 @@ class CreateResultsTransform(BaseTransform):
                 results = []
 
         self._create_results(results)
+        NAME_CACHE.flush()
 
     def get_results(self):
         election_ids = self.get_rawresults().distinct('election_id')
@@ -494,46 +626,40 @@ class CreateResultsTransform(BaseTransform):
         key = (raw_result.election_id, raw_result.contest_slug,
             raw_result.candidate_slug)
         try:
-            return self._candidate_cache[key]
+            return self._candidates.get(key)
         except KeyError:
             fields = self.get_candidate_fields(raw_result)
             fields.update(extra)
             del fields['source']
-            try:
-                candidate = Candidate.objects.get(**fields)
-            except Candidate.DoesNotExist:
-                raise
-            # self._candidate_cache[key] = candidate 
-            return candidate
+            return self._candidates.find(key, fields)
 
     def get_retention(self, raw_result, extra={}):
         """
         Get the Rentention model for a RawResult
         """
-        fields = self.get_retention_fields(raw_result)
-        fields.update(extra)
-        del fields['source']
+        key = (raw_result.election_id, raw_result.contest_slug,
+            self.standardize_value(raw_result.full_name))
         try:
-            retention = Retention.objects.get(**fields)
-        except Retention.DoesNotExist:
-            raise
-        # self._candidate_cache[key] = candidate 
-        return retention
+            return self._retentions.get(key)
+        except KeyError:
+            fields = self.get_retention_fields(raw_result)
+            fields.update(extra)
+            del fields['source']
+            return self._retentions.find(key, fields)
 
     def get_ballot_measure(self, raw_result, extra={}):
         """
         Get the BallotMeasure model for a RawResult
         """
-        fields = self.get_ballot_measure_fields(raw_result)
-        fields.update(extra)
-        del fields['source']
+        key = (raw_result.election_id, raw_result.contest_slug,
+            self.standardize_value(raw_result.full_name))
         try:
-            bm = BallotMeasure.objects.get(**fields)
-        except BallotMeasureesNotExist:
-            raise
-        # self._candidate_cache[key] = candidate 
-        return bm
-
+            return self._ballot_measures.get(key)
+        except KeyError:
+            fields = self.get_ballot_measure_fields(raw_result)
+            fields.update(extra)
+            del fields['source']
+            return self._ballot_measures.find(key, fields)
 
     def _create_results(self, results):
         """
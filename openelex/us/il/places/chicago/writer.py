@@ -0,0 +1,39 @@
+import os
+import json
+
+class ElectionWriter(object):
+    """
+    Writes an election's json file one contest at a time.
+
+    Contests are appended to <filename>.part as soon as they're scraped, so
+    only one contest needs to be held in memory & progress can be seen on
+    disk. close() finishes the json & renames it into place, so a file at
+    filename is always complete.
+    """
+
+    def __init__(self, filename, election_name):
+        self.filename = filename
+        self.part_filename = filename+'.part'
+        self.num_contests = 0
+
+        self._file = open(self.part_filename, 'w')
+        self._file.write('{\n    "election_name": %s, \n    "date": null, \n    "contests": [' % json.dumps(election_name))
+
+    def write_contest(self, contest_json):
+        lines = json.dumps(contest_json, indent=4).split('\n')
+        if self.num_contests:
+            self._file.write(', ')
+        self._file.write('\n' + '\n'.join('        '+line for line in lines))
+        self._file.flush()
+        self.num_contests += 1
+
+    def close(self):
+        if self.num_contests:
+            self._file.write('\n    ]\n}')
+        else:
+            self._file.write(']\n}')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+        os.rename(self.part_filename, self.filename)